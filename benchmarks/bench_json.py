@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Compares the JSON codecs on small, medium and large payloads.
+
+    $ python benchmarks/bench_json.py
+
+Only the libraries that are installed are compared.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import notrequests as nr
+
+
+def _record(n):
+    return {
+        'id': n,
+        'name': u'Item %d \u2603' % n,
+        'price': n * 1.25,
+        'tags': ['red', 'green', 'blue'],
+        'active': n % 2 == 0,
+        'owner': {'id': n * 7, 'url': 'https://example.com/users/%d' % n},
+    }
+
+
+payloads = [
+    ('small', _record(1)),
+    ('medium', [_record(n) for n in range(100)]),
+    ('large', {'results': [_record(n) for n in range(10000)]}),
+]
+
+
+def main():
+    for label, value in payloads:
+        encoded = nr.get_json_codec('json').dumps(value)
+        print('%s payload, %d bytes' % (label, len(encoded)))
+
+        for name in sorted(nr._json_codecs):
+            codec = nr.get_json_codec(name)
+
+            for action, func in (('dumps', lambda: codec.dumps(value)), ('loads', lambda: codec.loads(encoded))):
+                timer = timeit.Timer(func)
+                number, total = timer.autorange() if hasattr(timer, 'autorange') else (10, timer.timeit(10))
+                per_call = total / number * 1e6
+                print('  %-8s %s %12.1f us' % (name, action, per_call))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""Compares building an opener for every request with the shared openers.
+
+    $ python benchmarks/bench_opener.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import notrequests as nr
+
+
+def uncached(verify):
+    # What every request used to do.
+    return nr._make_opener(True, nr._create_ssl_context(verify))
+
+
+def cached(verify):
+    return nr._build_opener(allow_redirects=True, verify=verify)
+
+
+def main(number=200):
+    for verify in (True, False):
+        for func in (uncached, cached):
+            func(verify)
+            seconds = timeit.timeit(lambda: func(verify), number=number)
+            per_call = seconds / number * 1e6
+            print('%-8s verify=%-5s %10.1f us per request' % (func.__name__, verify, per_call))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compares request() with a RequestTemplate from prepare() for small requests.
+
+    $ python benchmarks/bench_prepare.py
+
+Building the request is timed on its own, then whole requests are made to a
+local server with a keep-alive session.
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import notrequests as nr
+from local_server import start_server, stop_server
+
+
+kwargs = {
+    'headers': {'Accept': 'application/json', 'X-Api-Version': '3'},
+    'auth': ('user', 'secret'),
+    'cookies': {'session': 'abc123'},
+}
+
+
+def bench_build(url):
+    template = nr.prepare('GET', url + '?sort=name', **kwargs)
+    funcs = [
+        ('_build_request', lambda: nr._build_request('GET', url + '?sort=name', params={'page': 2}, **kwargs)),
+        ('template.build', lambda: template.build({'page': 2})),
+    ]
+
+    for label, func in funcs:
+        timer = timeit.Timer(func)
+        number, total = timer.autorange() if hasattr(timer, 'autorange') else (10000, timer.timeit(10000))
+        print('%-16s %10.1f us per request' % (label, total / number * 1e6))
+
+
+def bench_requests(url, seconds=2.0):
+    with nr.Session() as session:
+        template = session.prepare('GET', url + '?sort=name', **kwargs)
+        funcs = [
+            ('session.get', lambda n: session.get(url + '?sort=name', params={'page': n}, **kwargs)),
+            ('template', lambda n: template(params={'page': n})),
+        ]
+
+        for label, func in funcs:
+            func(0)
+            count = 0
+            started = time.time()
+            while time.time() - started < seconds:
+                func(count)
+                count += 1
+            print('%-16s %10.1f requests/sec' % (label, count / (time.time() - started)))
+
+
+def main():
+    server, url = start_server()
+
+    try:
+        bench_build(url + '/items')
+        bench_requests(url + '/items')
+    finally:
+        stop_server(server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""Benchmarks notrequests against local HTTP servers.
+
+    $ python benchmarks/bench_suite.py --output results.json
+    $ python benchmarks/bench_suite.py --baseline results.json
+
+Each benchmark reports operations per second, latency percentiles and the
+peak memory allocated while it runs. Results are printed as JSON, or written
+to --output. With --baseline the results are compared with an earlier run,
+and the exit status is 1 if any benchmark got worse by more than --tolerance
+(a fraction, default 0.2).
+
+Use --only to run some of the benchmarks, and --duration for how many seconds
+to spend on each one.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import notrequests as nr
+from local_server import JSON_BODY, start_server, stop_server
+
+
+UPLOAD_BODY = b'x' * (1024 * 1024)
+FANOUT_HOSTS = 8
+FANOUT_REQUESTS = 64
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def small_get(ctx):
+    ctx.session.get(ctx.url + '/small').content
+
+
+def small_get_no_session(ctx):
+    nr.get(ctx.url + '/small').content
+
+
+def large_download(ctx):
+    response = ctx.session.get(ctx.url + '/download', stream=True)
+    for _ in response.iter_content(65536):
+        pass
+
+
+def json_get(ctx):
+    ctx.session.get(ctx.url + '/json').json()
+
+
+def json_decode(ctx):
+    # Response.json() on a body which has already been read.
+    raw = nr._BufferedResponse(200, 'OK', ctx.json_headers, ctx.url + '/json', JSON_BODY)
+    nr.Response(raw, ctx.json_request).json()
+
+
+def build_form_data(ctx):
+    files = {'file': io.BytesIO(UPLOAD_BODY), 'notes': io.BytesIO(b'notes')}
+    _, body = nr._build_form_data({'name': b'value'}, files)
+    for _ in body:
+        pass
+
+
+def multipart_upload(ctx):
+    files = {'file': io.BytesIO(UPLOAD_BODY)}
+    ctx.session.post(ctx.url + '/upload', data={'name': b'value'}, files=files).content
+
+
+def fanout(ctx):
+    urls = [ctx.fanout_urls[n % len(ctx.fanout_urls)] + '/small' for n in range(FANOUT_REQUESTS)]
+    for result in nr.map(urls, max_workers=16, per_host_limit=4, session=ctx.session):
+        if isinstance(result, Exception):
+            raise result
+
+
+# Name, function, and how many requests one call of the function makes.
+benchmarks = [
+    ('small_get', small_get, 1),
+    ('small_get_no_session', small_get_no_session, 1),
+    ('large_download', large_download, 1),
+    ('json_get', json_get, 1),
+    ('json_decode', json_decode, 0),
+    ('build_form_data', build_form_data, 0),
+    ('multipart_upload', multipart_upload, 1),
+    ('fanout', fanout, FANOUT_REQUESTS),
+]
+
+
+class Context(object):
+    def __init__(self, url, fanout_urls):
+        self.url = url
+        self.fanout_urls = fanout_urls
+        self.session = nr.Session(pool_maxsize=16)
+
+        response = self.session.get(url + '/json')
+        self.json_headers = response.headers
+        self.json_request = response.request
+
+
+def _percentile(ordered, percent):
+    index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+
+    return ordered[index]
+
+
+def run_benchmark(ctx, func, requests_per_call, duration, min_calls=5):
+    func(ctx)
+
+    latencies = []
+    started = _clock()
+    while len(latencies) < min_calls or _clock() - started < duration:
+        before = _clock()
+        func(ctx)
+        latencies.append(_clock() - before)
+
+    total = _clock() - started
+    latencies.sort()
+    result = {
+        'calls': len(latencies),
+        'ops_per_sec': round(len(latencies) / total, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(_percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+        'peak_memory_kb': None,
+    }
+
+    if requests_per_call:
+        result['requests_per_sec'] = round(len(latencies) * requests_per_call / total, 2)
+
+    # Measured separately, because tracing allocations is slow.
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func(ctx)
+        result['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    return result
+
+
+# For each measurement, True if bigger is better. The p99 latency is too noisy
+# to compare between runs.
+_measurements = {
+    'ops_per_sec': True,
+    'p50_ms': False,
+    'peak_memory_kb': False,
+}
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of (benchmark, measurement, old, new) which got worse."""
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        old_result = baseline.get(name)
+        if old_result is None:
+            continue
+
+        for measurement, bigger_is_better in sorted(_measurements.items()):
+            old, new = old_result.get(measurement), result.get(measurement)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / float(old)
+            if (change < -tolerance) if bigger_is_better else (change > tolerance):
+                regressions.append((name, measurement, old, new))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks notrequests against local HTTP servers.')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds for each benchmark')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='benchmarks to run')
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed change, as a fraction')
+    args = parser.parse_args(argv)
+
+    names = [name for name, _, _ in benchmarks]
+    for name in args.only or []:
+        if name not in names:
+            parser.error('unknown benchmark %r, choose from %s' % (name, ', '.join(names)))
+
+    servers = [start_server() for _ in range(FANOUT_HOSTS)]
+    ctx = Context(servers[0][1], [url for _, url in servers])
+    results = {}
+
+    try:
+        for name, func, requests_per_call in benchmarks:
+            if args.only and name not in args.only:
+                continue
+
+            results[name] = run_benchmark(ctx, func, requests_per_call, args.duration)
+            sys.stderr.write('%-22s %10.1f ops/sec  p99 %8.2f ms\n' % (
+                name, results[name]['ops_per_sec'], results[name]['p99_ms']))
+    finally:
+        ctx.session.close()
+        for server, _ in servers:
+            stop_server(server)
+
+    report = {
+        'meta': {
+            'notrequests': nr.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'duration': args.duration,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)['results']
+
+        regressions = compare(results, baseline, args.tolerance)
+        for name, measurement, old, new in regressions:
+            sys.stderr.write('Regression: %s %s %s -> %s\n' % (name, measurement, old, new))
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""A local keep-alive HTTP server for the benchmarks.
+
+    GET /json      a JSON array of 5000 records
+    GET /download  DOWNLOAD_SIZE bytes
+    GET <other>    a small JSON object
+    POST <any>     reads and discards the body, responds like GET <other>
+"""
+import json
+import socket
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+
+def _record(n):
+    return {
+        'id': n,
+        'name': u'Item %d ☃' % n,
+        'price': n * 1.25,
+        'tags': ['red', 'green', 'blue'],
+        'owner': {'id': n * 7, 'url': 'https://example.com/users/%d' % n},
+    }
+
+
+SMALL_BODY = b'{"ok": true}'
+JSON_BODY = json.dumps([_record(n) for n in range(5000)]).encode('utf-8')
+DOWNLOAD_SIZE = 10 * 1024 * 1024
+
+_chunk = b'x' * 65536
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # The headers and body are written separately.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        if self.path == '/json':
+            self.respond(JSON_BODY, 'application/json')
+        elif self.path == '/download':
+            self.send_response(200)
+            self.send_header('Content-Length', str(DOWNLOAD_SIZE))
+            self.end_headers()
+            for _ in range(DOWNLOAD_SIZE // len(_chunk)):
+                self.wfile.write(_chunk)
+        else:
+            self.respond(SMALL_BODY, 'application/json')
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                self.rfile.read(size + 2)
+                if not size:
+                    break
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            while length > 0:
+                length -= len(self.rfile.read(min(length, 65536)))
+
+        self.respond(SMALL_BODY, 'application/json')
+
+    def respond(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_server():
+    """Returns a running Server and its base URL. Stop it with stop_server()."""
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
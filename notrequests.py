@@ -1,22 +1,49 @@
 import base64
+import codecs
+import collections
+import copy
+import datetime
+import email.utils
+import errno
 import functools
+import heapq
+import io
+import itertools
 import json as simplejson
 import mimetypes
 import os
 import random
 import re
+import select
+import socket
 import ssl
+import sys
+import threading
+import time
+import zlib
+from stat import S_ISREG
 
 import six
+from six.moves import http_client
 from six.moves import http_cookiejar
+from six.moves import queue
 from six.moves import urllib
 
 
 __version__ = '0.7'
 _user_agent = 'notrequests/' + __version__
+_accept_encoding = 'gzip, deflate'
 LATIN1 = 'latin-1'
 JSON_TYPE = 'application/json'
+NDJSON_TYPE = 'application/x-ndjson'
 BINARY_TYPE = 'application/octet-stream'
+_default_ports = {'http': 80, 'https': 443}
+_clock = getattr(time, 'monotonic', time.time)
+_ssl_contexts = {}
+_openers = {}
+_max_openers = 16
+_chunk_size = 64 * 1024
+_json_accepts_bytes = sys.version_info >= (3, 6)
 
 _codes = {
     # Informational.
@@ -83,7 +110,36 @@ class HTTPError(IOError):
     """Something went wrong when making the request."""
 
 
+class Timeout(HTTPError, socket.timeout):
+    """The request took too long."""
+
+
+class TooManyRedirects(HTTPError):
+    """A request was redirected more than max_redirects times."""
+
+
+class ConnectTimeout(Timeout):
+    """Connecting to the server took longer than the connect timeout."""
+
+
+class ReadTimeout(Timeout):
+    """The server did not send any data for longer than the read timeout."""
+
+
+class DeadlineExceeded(Timeout):
+    """The whole request took longer than its deadline."""
+
+
 class Request(urllib.request.Request):
+    # A ConnectionPool to re-use connections from, set by Session.
+    pool = None
+    # The JSONCodec for the request and response bodies.
+    json_codec = None
+    # Where a file object body started, so it can be sent again.
+    body_position = None
+    # A DNSCache for looking up host names.
+    dns_cache = None
+
     def __init__(self, method, url, **kwargs):
         self._method = method
         urllib.request.Request.__init__(self, url, **kwargs)
@@ -92,15 +148,221 @@ class Request(urllib.request.Request):
         return self._method
 
 
+_missing = object()
+
+
 class Response(object):
-    def __init__(self, addinfourl, request):
+    # Slots keep responses small when many are kept. The cookies, text,
+    # links and JSON are worked out the first time they are used.
+    __slots__ = (
+        '_r',
+        '_max_content_size',
+        '_content',
+        '_content_consumed',
+        '_cookies',
+        '_text',
+        '_links',
+        '_json',
+        'request',
+        'status_code',
+        'headers',
+        'url',
+        'timings',
+        'history',
+        'from_cache',
+    )
+
+    def __init__(self, addinfourl, request, stream=False, max_content_size=None):
         self._r = addinfourl
+        self._max_content_size = max_content_size
         self.request = request
         self.status_code = self._r.getcode()
         self.headers = self._r.headers
-        self.cookies = self._read_cookies(self._r, request)
         self.url = self._r.geturl()
-        self.content = self._r.read()
+        self.timings = getattr(addinfourl, 'timings', None) or Timings()
+        # The redirect responses which led to this one, oldest first.
+        self.history = []
+        # True if the response came from a cache instead of the server.
+        self.from_cache = False
+        self._content = None
+        self._content_consumed = False
+        self._cookies = None
+        self._text = None
+        self._links = None
+        self._json = _missing
+
+        # With stream=True the body is read when it is used.
+        if not stream:
+            self.content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def raw(self):
+        """The urllib response, for reading the body with stream=True."""
+        return self._r
+
+    def close(self):
+        """Releases the connection. An unread body is not read."""
+        self._r.close()
+
+    @property
+    def content(self):
+        """The response body as a byte string."""
+        if self._content is None:
+            if self._content_consumed:
+                raise RuntimeError('The response body has already been read.')
+
+            if self._content_encoding() or self._max_content_size is not None:
+                self._content = b''.join(self._iter_body(_chunk_size))
+            else:
+                self._content_consumed = True
+                self._content = self._read_all()
+
+        return self._content
+
+    @property
+    def cookies(self):
+        """The cookies set by the response, as a dict."""
+        if self._cookies is None:
+            self._cookies = self._read_cookies(self._r, self.request)
+
+        return self._cookies
+
+    def _content_encoding(self):
+        encoding = (self.headers.get('Content-Encoding') or '').strip().lower()
+
+        return encoding if encoding in _decompress_wbits else None
+
+    def _iter_body(self, chunk_size):
+        # The body from the connection, decompressed if it was compressed.
+        chunks = self._iter_raw(chunk_size)
+
+        encoding = self._content_encoding()
+        if encoding:
+            chunks = _iter_decompress(chunks, encoding)
+
+        if self._max_content_size is not None:
+            chunks = _iter_limit(chunks, self._max_content_size)
+
+        return chunks
+
+    def _iter_raw(self, chunk_size):
+        if self._content_consumed:
+            raise RuntimeError('The response body has already been read.')
+
+        self._content_consumed = True
+
+        # With no chunk size, return data as soon as it arrives.
+        read = self._r.read
+        if chunk_size is None:
+            read = getattr(self._r, 'read1', read)
+            chunk_size = _chunk_size
+
+        timeouts = self._timeouts()
+        timings = self.timings
+        started = _clock()
+
+        try:
+            while True:
+                chunk = read(chunk_size)
+                if not chunk:
+                    break
+                timings.bytes_received += len(chunk)
+                yield chunk
+        except (EnvironmentError, http_client.HTTPException, ValueError) as err:
+            error = _timeout_error(timeouts, err)
+            if error is not None:
+                raise error
+            raise
+
+        # When the deadline passes the connection is shut down, which looks
+        # like the end of the body.
+        if timeouts is not None and timeouts.expired():
+            raise DeadlineExceeded('Deadline exceeded reading %s' % self.url)
+
+        timings.download = _clock() - started
+
+    def _timeouts(self):
+        timeout = getattr(self.request, 'timeout', None)
+
+        return timeout if isinstance(timeout, _Timeouts) else None
+
+    def _read_all(self):
+        timeouts = self._timeouts()
+        started = _clock()
+
+        try:
+            content = self._r.read()
+        except (EnvironmentError, http_client.HTTPException, ValueError) as err:
+            error = _timeout_error(timeouts, err)
+            if error is not None:
+                raise error
+            raise
+
+        if timeouts is not None and timeouts.expired():
+            raise DeadlineExceeded('Deadline exceeded reading %s' % self.url)
+
+        self.timings.download = _clock() - started
+        self.timings.bytes_received += len(content)
+
+        return content
+
+    @property
+    def elapsed(self):
+        """A timedelta from starting the request to receiving the headers."""
+        return datetime.timedelta(seconds=self.timings.elapsed)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        """Iterates over the response body in chunks of chunk_size bytes.
+
+        If the body has not already been read, it is read from the connection
+        as you iterate. A gzip or deflate body is decompressed, so chunks may
+        be larger than chunk_size. With decode_unicode=True the chunks are
+        decoded using the encoding from the response headers.
+        """
+        if self._content is not None:
+            size = chunk_size or _chunk_size
+            content = self._content
+            chunks = (content[i:i + size] for i in range(0, len(content), size))
+        else:
+            chunks = self._iter_body(chunk_size)
+
+        if decode_unicode:
+            encoding = self._encoding_from_message(self.headers)
+            if encoding:
+                chunks = _iter_decode(chunks, encoding)
+
+        return chunks
+
+    def iter_lines(self, chunk_size=512, decode_unicode=False, delimiter=None):
+        """Iterates over the response body one line at a time."""
+        pending = None
+
+        for chunk in self.iter_content(chunk_size, decode_unicode=decode_unicode):
+            if pending:
+                chunk = pending + chunk
+
+            # The last line is kept for the next chunk, because it may be
+            # incomplete. Without a delimiter it is kept with its line break,
+            # which may be the \r of a \r\n split between chunks.
+            if delimiter:
+                lines = chunk.split(delimiter)
+                pending = lines.pop()
+            else:
+                lines = chunk.splitlines()
+                pending = chunk.splitlines(True)[-1] if lines else None
+                del lines[-1:]
+
+            for line in lines:
+                yield line
+
+        if pending:
+            yield pending if delimiter else pending.splitlines()[0]
 
     @classmethod
     def _read_cookies(cls, response, request):
@@ -118,18 +380,56 @@ class Response(object):
         else:
             return message.get_content_charset()
 
+    def _json_codec(self):
+        return get_json_codec(getattr(self.request, 'json_codec', None))
+
     def json(self, **kwargs):
-        """Decodes response as JSON."""
-        encoding = detect_encoding(self.content[:4])
-        value = self.content.decode(encoding)
+        """Decodes response as JSON.
 
-        return simplejson.loads(value, **kwargs)
+        Without keyword arguments the result is kept, and the same object is
+        returned next time.
+        """
+        if kwargs:
+            return self._json_codec().loads(self.content, **kwargs)
+
+        if self._json is _missing:
+            self._json = self._json_codec().loads(self.content)
+
+        return self._json
+
+    def iter_json_items(self, path=None):
+        """Iterates over the items of a JSON array, decoding one at a time.
+
+        Use this for huge responses, with stream=True, so that the whole
+        array is never in memory. The array is the top-level value, or the
+        value at path inside nested objects. The path is a list of keys or a
+        string like 'data.items'.
+        """
+        if isinstance(path, six.string_types):
+            path = path.split('.')
+
+        chunks = self.iter_content(_chunk_size)
+        first = next(chunks, b'')
+        chunks = itertools.chain([first], chunks)
+        text = _iter_decode(chunks, detect_encoding(first[:4]), errors='strict')
+
+        return _JSONStream(text).iter_items(path or [])
+
+    def iter_json_lines(self):
+        """Iterates over a body of newline-delimited JSON (NDJSON) values."""
+        loads = self._json_codec().loads
+
+        for line in self.iter_lines(chunk_size=_chunk_size):
+            if line.strip():
+                yield loads(line)
 
     @property
     def text(self):
-        encoding = self._encoding_from_message(self.headers)
+        if self._text is None:
+            encoding = self._encoding_from_message(self.headers)
+            self._text = self.content.decode(encoding)
 
-        return self.content.decode(encoding)
+        return self._text
 
     @property
     def links(self):
@@ -140,26 +440,15 @@ class Response(object):
         #     'last': {'rel': 'last', 'url': 'https://example.com/?page=34'},
         #     'next': {'rel': 'next', 'url': 'https://example.com/?page=2'},
         # },
-        result = {}
-        if 'Link' in self.headers:
-            value = self.headers['Link']
-
-            for part in re.split(r', *<', value):
-                link = {}
-                vs = part.split(';')
-
-                # First section is always an url.
-                link['url'] = vs.pop(0).strip('\'" <>')
-
-                for v in vs:
-                    if '=' in v:
-                        key, v = v.split('=')
-                        link[key.strip('\'" ')] = v.strip('\'" ')
+        if self._links is None:
+            if six.PY2:
+                values = self.headers.getheaders('Link')
+            else:
+                values = self.headers.get_all('Link')
 
-                rkey = link.get('rel') or link['url']
-                result[rkey] = link
+            self._links = _parse_links(', '.join(values or []))
 
-        return result
+        return self._links
 
     @property
     def ok(self):
@@ -177,6 +466,67 @@ class Response(object):
             raise HTTPError(message)
 
 
+# A link is <url> followed by ;-separated parameters, and links are separated
+# by commas. Parameter values may be quoted strings containing ; , or =.
+_link_re = re.compile(
+    r'[\s,]*<([^>]*)>'
+    r'((?:\s*;\s*[^\s;,=]+(?:\s*=\s*(?:"(?:[^"\\]|\\.)*"|[^\s;,]*))?)*)'
+)
+_link_param_re = re.compile(r';\s*([^\s;,=]+)(?:\s*=\s*("(?:[^"\\]|\\.)*"|[^\s;,]*))?')
+_quoted_pair_re = re.compile(r'\\(.)')
+
+
+def _parse_links(value):
+    """Parses a Link header (RFC 8288) to a dict of links by relation type.
+
+    A link with more than one relation type (rel="next last") is in the
+    result for each. Relation types are case-insensitive, so they are keyed
+    in lower case. A link with no rel is keyed by its URL.
+    """
+    result = {}
+    pos = 0
+
+    while True:
+        match = _link_re.match(value, pos)
+        if match is None:
+            break
+
+        pos = match.end()
+        link = {'url': match.group(1).strip()}
+
+        for key, param in _link_param_re.findall(match.group(2)):
+            if param[:1] == '"':
+                param = _quoted_pair_re.sub(r'\1', param[1:-1])
+
+            # Only the first of a repeated parameter counts.
+            link.setdefault(key.lower(), param)
+
+        for rel in link.get('rel', '').lower().split() or [link['url']]:
+            result[rel] = link
+
+    return result
+
+
+class _BufferedResponse(io.BytesIO):
+    """A urllib-style response for a body which has already been read."""
+
+    def __init__(self, status, reason, headers, url, body=b''):
+        io.BytesIO.__init__(self, body)
+        self.status = self.code = status
+        self.reason = self.msg = reason
+        self.headers = headers
+        self.url = url
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+
 class HTTPErrorHandler(urllib.request.HTTPDefaultErrorHandler):
     def http_error_default(self, req, fp, code, msg, hdrs):
         # urllib2 raises an exception on 4xx and 5xx. Make us behave more like
@@ -186,63 +536,2083 @@ class HTTPErrorHandler(urllib.request.HTTPDefaultErrorHandler):
 
 class HTTPRedirectHandler(urllib.request.HTTPRedirectHandler):
     def redirect_request(self, req, fp, code, msg, headers, newurl):
-        # urllib2 follows redirects by default. This handler doesn't.
+        # urllib2 follows redirects by default. This handler doesn't, because
+        # request() follows them itself.
         return None
 
 
-def detect_encoding(value):
-    """Returns the character encoding for a JSON string."""
-    # https://tools.ietf.org/html/rfc4627#section-3
-    if six.PY2:
-        null_pattern = tuple(bool(ord(char)) for char in value[:4])
+class ConnectionPool(object):
+    """Keeps idle HTTP connections for re-use, keyed by scheme, host and port.
+
+    At most maxsize idle connections are kept for each host. Connections which
+    have been idle for more than idle_timeout seconds are closed instead of
+    being re-used.
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
+
+    def _evict(self, idle, now):
+        # Oldest connections are on the left.
+        while idle and now - idle[0][1] >= self.idle_timeout:
+            conn, _ = idle.popleft()
+            conn.close()
+
+    def get(self, key):
+        """Returns an idle connection for key, or None."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if not idle:
+                return None
+
+            self._evict(idle, _clock())
+
+            while idle:
+                conn, _ = idle.pop()
+                if not _is_connection_dropped(conn):
+                    return conn
+                conn.close()
+
+    def put(self, key, conn):
+        """Returns a connection to the pool, or closes it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, collections.deque())
+            now = _clock()
+            self._evict(idle, now)
+
+            if len(idle) < self.maxsize:
+                idle.append((conn, now))
+                return
+
+        conn.close()
+
+    def clear(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+
+def _is_connection_dropped(conn):
+    """True if an idle connection was closed by the server."""
+    # An idle connection should have nothing to read, so if it is readable
+    # the server has closed it (or sent something we don't understand).
+    sock = conn.sock
+    if sock is None:
+        return True
+
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+
+    readable, _, _ = select.select([sock], [], [], 0)
+
+    return bool(readable)
+
+
+def _connection_was_reset(exc):
+    """True if exc means the server closed a connection we tried to re-use."""
+    if isinstance(exc, http_client.BadStatusLine):
+        return True
+
+    reason = getattr(exc, 'reason', exc)
+    reset_errors = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    return getattr(reason, 'errno', None) in reset_errors
+
+
+def _pool_key(req, context=None):
+    parts = urllib.parse.urlsplit('//' + req.host)
+    port = parts.port or _default_ports.get(req.type)
+
+    return req.type, parts.hostname, port, req._tunnel_host, context
+
+
+class _PooledHTTPResponse(http_client.HTTPResponse):
+    # Once the body has been read the connection can be used for another
+    # request. Closing the response before reading all of the body means the
+    # connection has to be closed too.
+    _on_release = None
+
+    def _release(self, reusable):
+        callback, self._on_release = self._on_release, None
+        if callback is not None:
+            callback(reusable)
+
+    def _close_conn(self):
+        reusable = not self.closed
+        http_client.HTTPResponse._close_conn(self)
+        self._release(reusable)
+
+    def close(self):
+        http_client.HTTPResponse.close(self)
+        self._release(False)
+
+
+class _ConnectionHandler(object):
+    # Like urllib's AbstractHTTPHandler.do_open(), but keeps connections open
+    # when the request has a pool to return them to.
+
+    def _open(self, connection_class, req, context=None, **kwargs):
+        if not req.host:
+            raise urllib.error.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers = {name.title(): value for name, value in headers.items()}
+
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            # Proxy-Authorization should not be sent to the origin server.
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        # Requests made by urllib's redirect handler are not our Request class.
+        # Python 2's httplib doesn't say when the body has been read, so there
+        # is no pooling.
+        pool = None if six.PY2 else getattr(req, 'pool', None)
+        if pool is None:
+            headers['Connection'] = 'close'
+
+        timeouts = req.timeout if isinstance(req.timeout, _Timeouts) else None
+        if timeouts is not None:
+            timeout, read_timeout = timeouts.connect_timeout(), timeouts.read
+        else:
+            timeout = req.timeout
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            read_timeout = timeout
+
+        key = _pool_key(req, context)
+        conn = None if pool is None else pool.get(key)
+
+        if conn is not None:
+            conn.timeout = timeout
+            conn.read_timeout = read_timeout
+            conn.timeouts = timeouts
+            conn.sock.settimeout(read_timeout)
+
+            try:
+                return self._send(conn, key, req, headers, pool)
+            except (http_client.HTTPException, socket.error) as exc:
+                # The server may close an idle connection at any time. If so,
+                # try again on a new connection (if the body can be re-sent).
+                data = req.data
+                replayable = data is None or isinstance(data, six.binary_type)
+                if not (replayable and _connection_was_reset(exc)):
+                    raise
+
+        if context is not None:
+            kwargs['context'] = context
+
+        conn = connection_class(req.host, timeout=timeout, **kwargs)
+        conn.read_timeout = read_timeout
+        conn.timeouts = timeouts
+        conn.dns_cache = getattr(req, 'dns_cache', None)
+        conn.tls_session_key = key
+        conn.set_debuglevel(self._debuglevel)
+
+        if req._tunnel_host:
+            conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+
+        return self._send(conn, key, req, headers, pool)
+
+    def _send(self, conn, key, req, headers, pool):
+        kwargs = {}
+        if req.has_header('Transfer-encoding'):
+            kwargs['encode_chunked'] = True
+
+        conn.response_class = _PooledHTTPResponse
+
+        # Multipart bodies with a known length write themselves to the socket
+        # after the headers, so files can be sent with sendfile().
+        body = req.data
+        send_body = isinstance(body, MultipartBody) and body.length is not None
+
+        timings = conn.timings = Timings()
+
+        # Past the deadline the watchdog shuts down the socket.
+        timeouts = getattr(conn, 'timeouts', None)
+        watch = None
+        if timeouts is not None and timeouts.expires is not None:
+            watch = _watchdog.watch(conn, timeouts.expires)
+
+        # Python 2's Request has get_selector() instead of selector.
+        selector = req.get_selector() if six.PY2 else req.selector
+        started = _clock()
+
+        try:
+            try:
+                if send_body:
+                    conn.request(req.get_method(), selector, None, headers)
+                    body.send(conn.sock)
+                    timings.bytes_sent += body.length
+                else:
+                    conn.request(req.get_method(), selector, body, headers, **kwargs)
+
+                # The connection lets go of its socket when the response is
+                # the last on the connection, but the response still reads it.
+                sock = conn.sock
+                if watch is not None:
+                    # Python 2's httplib closes the connection's socket
+                    # object, but not the socket the response reads from.
+                    watch[3] = sock._sock if six.PY2 else sock
+            except Timeout:
+                raise
+            except socket.error as err:
+                error = _timeout_error(timeouts, err, ConnectTimeout if conn.sock is None else ReadTimeout)
+                raise error or urllib.error.URLError(err)
+
+            try:
+                response = conn.getresponse()
+            except (EnvironmentError, http_client.HTTPException) as err:
+                error = _timeout_error(timeouts, err)
+                if error is not None:
+                    raise error
+                raise
+        except:
+            _watchdog.unwatch(watch)
+            conn.close()
+            raise
+
+        timings.ttfb = _clock() - started - (timings.dns or 0) - (timings.connect or 0) - (timings.tls or 0)
+
+        # With TLS 1.3 the session arrives after the handshake, so it is kept
+        # once the response headers have been read.
+        if timings.tls_resumed is False:
+            session = getattr(sock, 'session', None)
+            if session is not None:
+                _tls_sessions.put(key, session)
+
+        response._on_release = functools.partial(self._release, pool, key, conn, watch)
+
+        if six.PY2:
+            response.recv = response.read
+            fp = socket._fileobject(response, close=True)
+            wrapped = urllib.response.addinfourl(fp, response.msg, req.get_full_url())
+            wrapped.code = response.status
+            wrapped.msg = response.reason
+            wrapped.timings = timings
+
+            return wrapped
+
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        response.timings = timings
+
+        return response
+
+    def _release(self, pool, key, conn, watch, reusable):
+        _watchdog.unwatch(watch)
+
+        if pool is not None and reusable and conn.sock is not None:
+            pool.put(key, conn)
+        else:
+            conn.close()
+
+
+class _HTTPConnection(http_client.HTTPConnection):
+    # Connects with the connect timeout, then uses read_timeout. Records
+    # timings and bytes sent for the current request.
+    read_timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+    timeouts = None
+    timings = None
+    dns_cache = None
+
+    def connect(self):
+        _connect(self, http_client.HTTPConnection.connect)
+
+    def send(self, data):
+        _count_sent(self.timings, data)
+        http_client.HTTPConnection.send(self, data)
+
+
+class _HTTPSConnection(http_client.HTTPSConnection):
+    read_timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+    timeouts = None
+    timings = None
+    dns_cache = None
+    # Where to find a TLS session to resume, in _tls_sessions.
+    tls_session_key = None
+
+    def connect(self):
+        if hasattr(ssl, 'SSLSession'):
+            _connect(self, _HTTPSConnection._connect_tls)
+        else:
+            _connect(self, http_client.HTTPSConnection.connect)
+
+    def _connect_tls(self):
+        # Like HTTPSConnection.connect(), but resumes a TLS session if there
+        # is one for the host.
+        http_client.HTTPConnection.connect(self)
+
+        server_hostname = self._tunnel_host or self.host
+        session = _tls_sessions.get(self.tls_session_key)
+        try:
+            self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=session)
+        except ValueError:
+            # The session was for a different context.
+            _tls_sessions.discard(self.tls_session_key)
+            self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname)
+
+        if self.timings is not None:
+            self.timings.tls_resumed = self.sock.session_reused
+
+    def send(self, data):
+        _count_sent(self.timings, data)
+        http_client.HTTPSConnection.send(self, data)
+
+
+def _connect(conn, connect):
+    timings = conn.timings
+    conn._create_connection = functools.partial(_create_connection, timings, conn.dns_cache)
+    started = _clock()
+
+    try:
+        connect(conn)
+    except socket.timeout as err:
+        raise _timeout_error(conn.timeouts, err, ConnectTimeout)
+
+    if timings is not None:
+        timings.reused_connection = False
+        if isinstance(conn, http_client.HTTPSConnection):
+            timings.tls = _clock() - started - (timings.dns or 0) - (timings.connect or 0)
+
+    if conn.read_timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+        conn.sock.settimeout(conn.read_timeout)
+
+
+def _create_connection(timings, dns_cache, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                       source_address=None):
+    """Like socket.create_connection(), recording how long each step took.
+
+    With a DNSCache the host is looked up in the cache, and the addresses are
+    tried with Happy Eyeballs.
+    """
+    host, port = address
+    started = _clock()
+    if dns_cache is None:
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
     else:
-        null_pattern = tuple(bool(char) for char in value[:4])
+        addresses = dns_cache.resolve(host, port)
+    resolved = _clock()
 
-    encodings = {
-        # Zero is a null-byte, 1 is anything else.
-        (0, 0, 0, 1): 'utf-32-be',
-        (0, 1, 0, 1): 'utf-16-be',
-        (1, 0, 0, 0): 'utf-32-le',
-        (1, 0, 1, 0): 'utf-16-le',
-    }
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+
+    if dns_cache is not None and dns_cache.happy_eyeballs_delay is not None:
+        sock = _happy_eyeballs(addresses, timeout, source_address, dns_cache.happy_eyeballs_delay)
+    else:
+        sock = _connect_in_turn(addresses, timeout, source_address)
+
+    if timings is not None:
+        timings.dns = resolved - started
+        timings.connect = _clock() - resolved
+
+    return sock
+
+
+def _connect_in_turn(addresses, timeout, source_address):
+    error = None
+
+    for family, socktype, proto, _, sockaddr in addresses:
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+        except socket.error as err:
+            error = err
+            if sock is not None:
+                sock.close()
+            continue
+
+        return sock
+
+    raise error or socket.error('getaddrinfo returned no addresses')
+
+
+_connecting_errnos = (errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', None))
+
+
+def _happy_eyeballs(addresses, timeout, source_address, delay):
+    """Connects to the first address which accepts, like RFC 8305.
+
+    Attempts start delay seconds apart, or straight away when the previous
+    attempt fails, alternating between IPv6 and IPv4 addresses.
+    """
+    waiting = list(_interleave_families(addresses))
+    pending = []
+    error = None
+    expires = None if timeout is None else _clock() + timeout
+
+    try:
+        while waiting or pending:
+            if waiting:
+                family, socktype, proto, _, sockaddr = waiting.pop(0)
+                try:
+                    sock = socket.socket(family, socktype, proto)
+                except socket.error as err:
+                    # For example, IPv6 is not supported.
+                    error = err
+                    continue
+
+                try:
+                    sock.setblocking(False)
+                    if source_address:
+                        sock.bind(source_address)
+                    code = sock.connect_ex(sockaddr)
+                except socket.error as err:
+                    code = err.errno
+
+                if code in _connecting_errnos or code == 0:
+                    pending.append(sock)
+                else:
+                    error = socket.error(code, os.strerror(code))
+                    sock.close()
+                    continue
+
+            wait = delay if waiting else None
+            if expires is not None:
+                remaining = expires - _clock()
+                if remaining <= 0:
+                    raise socket.timeout('timed out')
+                wait = remaining if wait is None else min(wait, remaining)
+
+            for sock in _wait_writable(pending, wait):
+                pending.remove(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    error = socket.error(code, os.strerror(code))
+                    sock.close()
+                    continue
+
+                sock.settimeout(timeout)
+                return sock
+
+        raise error or socket.error('getaddrinfo returned no addresses')
+    finally:
+        for sock in pending:
+            sock.close()
+
+
+def _interleave_families(addresses):
+    """Alternates address families, starting with the first address's family."""
+    families = collections.OrderedDict()
+    for address in addresses:
+        families.setdefault(address[0], []).append(address)
+
+    groups = list(families.values())
+    for index in range(max(len(group) for group in groups) if groups else 0):
+        for group in groups:
+            if index < len(group):
+                yield group[index]
+
+
+def _wait_writable(socks, timeout):
+    """Returns the sockets that are writable (or failed) within timeout."""
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        by_fd = {}
+        for sock in socks:
+            by_fd[sock.fileno()] = sock
+            poller.register(sock, select.POLLOUT)
+
+        events = poller.poll(None if timeout is None else timeout * 1000)
+
+        return [by_fd[fd] for fd, _ in events]
+
+    _, writable, failed = select.select([], socks, socks, timeout)
+
+    return writable + [sock for sock in failed if sock not in writable]
+
+
+class DNSCache(object):
+    """Remembers host name lookups, so new connections don't wait for DNS.
+
+    Addresses are kept for ttl seconds, and failed lookups for negative_ttl
+    seconds. Each lookup returns the addresses rotated by one, so that new
+    connections are spread over all of a host's addresses.
+
+    A host with IPv6 and IPv4 addresses is connected to with Happy Eyeballs:
+    if the first address has not connected after happy_eyeballs_delay
+    seconds the next is tried at the same time. Use None to try addresses
+    one after the other.
+
+    resolver is called as resolver(host, port) and returns a list like
+    socket.getaddrinfo() does. The default uses socket.getaddrinfo().
+    """
+
+    def __init__(self, ttl=60, negative_ttl=5, max_entries=1000, happy_eyeballs_delay=0.25,
+                 resolver=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.resolver = resolver or _getaddrinfo
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resolve(self, host, port):
+        """Returns the addresses for host and port, like socket.getaddrinfo()."""
+        key = (host, port)
+        now = _clock()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                expires, addresses, error, turn = entry
+                if error is not None:
+                    raise error
+
+                self._entries[key] = (expires, addresses, None, turn + 1)
+                turn %= len(addresses)
+
+                return addresses[turn:] + addresses[:turn]
+
+        # Looked up outside the lock, so a slow lookup only holds up
+        # requests for the same host.
+        try:
+            addresses = list(self.resolver(host, port))
+        except socket.gaierror as err:
+            self._store(key, now + self.negative_ttl, None, err)
+            raise
+
+        if not addresses:
+            error = socket.gaierror(socket.EAI_NONAME, 'No addresses for %s' % host)
+            self._store(key, now + self.negative_ttl, None, error)
+            raise error
+
+        self._store(key, now + self.ttl, addresses, None)
+
+        return addresses
+
+    def _store(self, key, expires, addresses, error):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, addresses, error, 1)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _getaddrinfo(host, port):
+    return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+
+def _count_sent(timings, data):
+    if timings is None:
+        return
+
+    if hasattr(data, 'read'):
+        timings.bytes_sent += _file_size(data) or 0
+    else:
+        timings.bytes_sent += len(data)
+
+
+class TLSSessionCache(object):
+    """Keeps TLS sessions so new connections can resume them.
+
+    Resuming a session skips most of the TLS handshake. Sessions are kept
+    for each host, port and SSL context, for at most maxsize hosts.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        with self._lock:
+            return self._sessions.get(key)
+
+    def put(self, key, session):
+        with self._lock:
+            self._sessions.pop(key, None)
+            self._sessions[key] = session
+
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+_tls_sessions = TLSSessionCache()
+
+
+class Timings(object):
+    """Where the time went in a request, and how many bytes were sent.
+
+    Times are in seconds. dns, connect and tls are None when the request
+    re-used a connection (and tls is None for plain HTTP). ttfb is from
+    sending the request to receiving the response headers, and download is
+    the time reading the body, None until all of it has been read.
+    bytes_received counts the body as it arrived, before decompression.
+    tls_resumed is True if a new HTTPS connection resumed a TLS session.
+    """
+
+    def __init__(self):
+        self.dns = None
+        self.connect = None
+        self.tls = None
+        self.ttfb = None
+        self.download = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.reused_connection = True
+        self.tls_resumed = None
+
+    def __repr__(self):
+        names = ['dns', 'connect', 'tls', 'ttfb', 'download']
+        values = ['%s=%.3f' % (name, getattr(self, name)) for name in names if getattr(self, name) is not None]
+
+        return '<Timings %s>' % ' '.join(values)
+
+    @property
+    def elapsed(self):
+        """Seconds from starting the request to receiving the headers."""
+        return sum(value or 0 for value in (self.dns, self.connect, self.tls, self.ttfb))
+
+    @property
+    def total(self):
+        """Seconds from starting the request to reading all of the body."""
+        return self.elapsed + (self.download or 0)
+
+
+class HTTPHandler(urllib.request.HTTPHandler, _ConnectionHandler):
+    def http_open(self, req):
+        return self._open(_HTTPConnection, req)
+
+
+class HTTPSHandler(urllib.request.HTTPSHandler, _ConnectionHandler):
+    def https_open(self, req):
+        return self._open(_HTTPSConnection, req, context=self._context)
+
+
+class _Timeouts(object):
+    # The timeouts for one call of request(), shared by its redirects, hedges
+    # and retries. urllib passes it on to redirects as the request timeout.
+
+    def __init__(self, timeout=None, deadline=None):
+        self.connect, self.read = _split_timeout(timeout)
+        self.expires = None if deadline is None else _clock() + deadline
+
+    def remaining(self):
+        return None if self.expires is None else self.expires - _clock()
+
+    def expired(self):
+        return self.expires is not None and _clock() >= self.expires
+
+    def connect_timeout(self):
+        """The connect timeout, shortened to the time left before the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return self.connect
+
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded')
+
+        return remaining if self.connect is None else min(self.connect, remaining)
+
+
+def _split_timeout(timeout):
+    """Returns (connect, read) timeouts from a number or a pair."""
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return connect, read
+
+    return timeout, timeout
+
+
+def _timeout_error(timeouts, err, timeout_class=ReadTimeout):
+    """Returns the Timeout to raise instead of err, or None."""
+    if isinstance(err, Timeout):
+        return err
+
+    if timeouts is not None and timeouts.expired():
+        return DeadlineExceeded('Deadline exceeded')
+
+    if isinstance(err, socket.timeout):
+        return timeout_class(str(err) or 'timed out')
+
+    return None
+
+
+class _Watchdog(object):
+    # Shuts down the sockets of requests which are past their deadline, so a
+    # read which is blocked (or trickling) returns. One thread watches every
+    # connection, and cancelled watches are skipped when they come up.
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def watch(self, conn, expires):
+        watch = [expires, next(self._counter), conn, None]
+
+        with self._condition:
+            heapq.heappush(self._heap, watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notrequests-watchdog')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+        return watch
+
+    def unwatch(self, watch):
+        if watch is not None:
+            with self._condition:
+                watch[2] = None
+
+    def _run(self):
+        heap = self._heap
+
+        with self._condition:
+            while True:
+                while heap and heap[0][2] is None:
+                    heapq.heappop(heap)
+
+                if not heap:
+                    self._condition.wait()
+                    continue
+
+                wait = heap[0][0] - _clock()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                watch = heapq.heappop(heap)
+                conn, watch[2] = watch[2], None
+
+                # The lock is held so the connection cannot be released to
+                # the pool, and used by another request, first.
+                sock = watch[3] or conn.sock
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+
+
+_watchdog = _Watchdog()
+
+
+class Session(object):
+    """Makes requests which re-use connections to the same host.
+
+    Idle connections are kept in a ConnectionPool, with at most pool_maxsize
+    connections for each host. Connections that have been idle for more than
+    pool_timeout seconds are closed.
+
+    If cache is given (a MemoryCache or SQLiteCache) it is used for every
+    request made with the session. Likewise json_codec, a JSONCodec or the
+    name of one, is used to encode and decode JSON, retries (a Retry or a
+    number of retries) is used when a request fails, hedge (a Hedge or a
+    delay in seconds) is used for GET and HEAD requests, hooks are called
+    before the hooks for each request, dns_cache (a DNSCache) is used to look
+    up host names, and redirect_cache (a RedirectCache) remembers permanent
+    redirects.
+
+    Cookies set by responses are kept in session.cookies, a CookieJar, and
+    sent with later requests. Pass cookies to use a CookieJar of your own.
+    """
+
+    def __init__(self, pool_maxsize=10, pool_timeout=60, cache=None, json_codec=None,
+                 retries=None, hedge=None, hooks=None, dns_cache=None, redirect_cache=None,
+                 cookies=None):
+        self.pool = ConnectionPool(maxsize=pool_maxsize, idle_timeout=pool_timeout)
+        self.cache = cache
+        self.json_codec = json_codec
+        self.retries = retries
+        self.hedge = hedge
+        self.hooks = hooks
+        self.dns_cache = dns_cache
+        self.redirect_cache = redirect_cache
+        self.cookies = CookieJar() if cookies is None else cookies
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes idle connections."""
+        self.pool.clear()
+
+    def request(self, method, url, **kwargs):
+        return request(method, url, session=self, **kwargs)
+
+    def prepare(self, method, url, **kwargs):
+        """Returns a RequestTemplate for making requests with the session."""
+        return prepare(method, url, session=self, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+
+_hook_events = ('pre_request', 'response')
+_hooks = {event: [] for event in _hook_events}
+
+
+def register_hook(event, hook):
+    """Calls hook for every request, before any hooks given for the request.
+
+    The event is 'pre_request', when hook is called with the Request before
+    it is sent, or 'response', when hook is called with the Response. If
+    hook returns something other than None it replaces the request or
+    response.
+    """
+    if event not in _hooks:
+        raise ValueError('Unknown hook event %r, use one of %s' % (event, ', '.join(_hook_events)))
+
+    _hooks[event].append(hook)
+
+
+def unregister_hook(event, hook):
+    """Stops calling a hook added with register_hook()."""
+    _hooks[event].remove(hook)
+
+
+def _merge_hooks(*mappings):
+    """Combines dicts of event to hook, or list of hooks, in order."""
+    merged = {}
+    for hooks in mappings:
+        for event, value in (hooks or {}).items():
+            if event not in _hooks:
+                raise ValueError('Unknown hook event %r, use one of %s' % (event, ', '.join(_hook_events)))
+
+            merged.setdefault(event, []).extend([value] if callable(value) else value)
+
+    return merged
+
+
+def _dispatch_hook(event, hooks, value):
+    for hook in itertools.chain(_hooks[event], hooks.get(event, ())):
+        result = hook(value)
+        if result is not None:
+            value = result
+
+    return value
+
+
+class Retry(object):
+    """When and how often to try a failed request again.
+
+    A request is retried after an error, or when the response status is in
+    status_forcelist, at most total times. Because the server may have acted
+    on the first attempt, only allowed_methods are retried after the request
+    was sent. Errors connecting to the server are retried for any method.
+
+    Before retry n it sleeps for up to backoff_factor * 2 ** (n - 1) seconds,
+    at most backoff_max, chosen at random unless jitter is False. With
+    respect_retry_after the response's Retry-After header sets the delay
+    instead, and a delay longer than backoff_max gives up. No retry starts
+    more than max_time seconds after the first attempt.
+    """
+    default_allowed_methods = frozenset(['DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE'])
+    default_status_forcelist = frozenset([429, 502, 503, 504])
+
+    def __init__(self, total=3, backoff_factor=0.5, status_forcelist=None,
+                 allowed_methods=None, respect_retry_after=True, backoff_max=120,
+                 jitter=True, max_time=None):
+        if status_forcelist is None:
+            status_forcelist = self.default_status_forcelist
+
+        if allowed_methods is None:
+            allowed_methods = self.default_allowed_methods
+
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = frozenset(status_forcelist)
+        self.allowed_methods = frozenset(method.upper() for method in allowed_methods)
+        self.respect_retry_after = respect_retry_after
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.max_time = max_time
+
+    def __repr__(self):
+        return '<Retry total=%r backoff_factor=%r>' % (self.total, self.backoff_factor)
+
+    def _delay(self, method, retry, elapsed, error=None, response=None):
+        """Seconds to sleep before retry number retry, or None to give up."""
+        if retry > self.total:
+            return None
+
+        allowed = method.upper() in self.allowed_methods
+
+        if error is not None:
+            if not (allowed or _is_connect_error(error)):
+                return None
+        elif not (allowed and response.status_code in self.status_forcelist):
+            return None
+
+        delay = None
+        if response is not None and self.respect_retry_after:
+            delay = _parse_retry_after(response.headers.get('Retry-After'))
+            if delay is not None and delay > self.backoff_max:
+                return None
+
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_factor * 2 ** (retry - 1))
+            if self.jitter:
+                delay = random.uniform(0, delay)
+
+        if self.max_time is not None and elapsed + delay > self.max_time:
+            return None
+
+        return delay
+
+
+class Hedge(object):
+    """When to send a second copy of a slow request.
+
+    If there is no response after delay seconds the request is sent again,
+    up to max_hedges times, and the first response wins. The others are
+    closed when they arrive. Only methods are hedged, which are GET and HEAD
+    by default, because the server acts on every copy of the request.
+
+    With delay=None the delay is the percentile of the last window response
+    times, so only the slowest requests are hedged. Until there are
+    min_samples response times no requests are hedged. Share one Hedge
+    between requests (for example on a Session) so it can learn.
+    """
+    default_methods = frozenset(['GET', 'HEAD'])
+
+    def __init__(self, delay=None, percentile=95, window=100, min_samples=20,
+                 max_hedges=1, methods=None):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.methods = frozenset(m.upper() for m in (methods or self.default_methods))
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Hedge delay=%r percentile=%r>' % (self.delay, self.percentile)
+
+    def _record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _delay(self):
+        """Seconds to wait before sending a copy, or None to never send one."""
+        if self.delay is not None:
+            return self.delay
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        if not latencies or len(latencies) < self.min_samples:
+            return None
+
+        index = int(round(self.percentile / 100.0 * (len(latencies) - 1)))
+
+        return latencies[index]
+
+
+def _hedge_policy(hedge):
+    """Returns a Hedge for the hedge argument, or None for no hedging."""
+    if hedge is None or hedge is False or isinstance(hedge, Hedge):
+        return hedge
+
+    return Hedge(delay=hedge)
+
+
+def _copy_request(request):
+    clone = copy.copy(request)
+    clone.headers = dict(request.headers)
+    clone.unredirected_hdrs = dict(request.unredirected_hdrs)
+
+    return clone
+
+
+def _hedged_send(send, request, hedge):
+    """Calls send(request), and again with copies if it is slow.
+
+    Returns the first response. An error is raised if every copy fails.
+    """
+    results = queue.Queue()
+    lock = threading.Lock()
+    finished = []
+
+    def run(req):
+        started = _clock()
+        try:
+            result = (send(req), None)
+        except Exception as err:
+            result = (None, err)
+        else:
+            hedge._record(_clock() - started)
+
+        with lock:
+            if finished and result[0] is not None:
+                result[0].raw.close()
+            else:
+                results.put(result)
+
+    def start(req):
+        thread = threading.Thread(target=run, args=(req,))
+        thread.daemon = True
+        thread.start()
+
+    delay = hedge._delay()
+    start(request)
+    pending = 1
+    hedges = 0
+
+    while True:
+        wait = delay if delay is not None and hedges < hedge.max_hedges else None
+        try:
+            response, error = results.get(timeout=wait)
+        except queue.Empty:
+            start(_copy_request(request))
+            pending += 1
+            hedges += 1
+            continue
+
+        pending -= 1
+        if error is None or not pending:
+            break
+
+    with lock:
+        finished.append(True)
+
+        # Close any response which arrived while this one was chosen.
+        while not results.empty():
+            other, _ = results.get()
+            if other is not None:
+                other.raw.close()
+
+    if error is not None:
+        raise error
+
+    return response
+
+
+def _retry_policy(retries):
+    """Returns a Retry for the retries argument, or None for no retries."""
+    if retries is None or retries is False:
+        return None
+
+    if isinstance(retries, Retry):
+        return retries
+
+    return Retry(total=retries)
+
+
+def _parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, or None."""
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+
+    timestamp = _parse_http_date(value)
+    if timestamp is None:
+        return None
+
+    return max(timestamp - time.time(), 0)
+
+
+_connect_errnos = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+
+
+def _is_connect_error(error):
+    """True if the error means the request never reached the server."""
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+
+    if isinstance(error, ConnectTimeout):
+        return True
+
+    return isinstance(error, socket.gaierror) or getattr(error, 'errno', None) in _connect_errnos
+
+
+def _is_retryable_error(error):
+    """True for connection errors, which may not happen a second time."""
+    # URLError wraps the socket error, or has a message like "unknown url type".
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+
+    if isinstance(error, (ConnectTimeout, ReadTimeout)):
+        return True
+
+    if isinstance(error, (HTTPError, ssl.CertificateError)):
+        return False
+
+    return isinstance(error, (socket.error, http_client.HTTPException))
+
+
+def _in_time(timeout, delay):
+    """True if a retry after delay seconds would start before the deadline."""
+    if delay is None:
+        return False
+
+    if not isinstance(timeout, _Timeouts) or timeout.expires is None:
+        return True
+
+    return _clock() + delay < timeout.expires
+
+
+def _rewind_body(request):
+    """Prepares the request body to be sent again. False if it cannot be."""
+    data = request.data
+    if data is None or isinstance(data, six.binary_type):
+        return True
+
+    rewind = getattr(data, 'rewind', None)
+    if rewind is not None:
+        return rewind()
+
+    position = getattr(request, 'body_position', None)
+    if position is None:
+        return False
+
+    data.seek(position)
+
+    return True
+
+
+def _tell(fileobj):
+    try:
+        return fileobj.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+
+class CacheEntry(object):
+    """A response kept by a cache. Headers are a list of (name, value) pairs."""
+
+    def __init__(self, status, reason, url, headers, body, vary=None, stored_at=None):
+        self.status = status
+        self.reason = reason
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.vary = vary or {}
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def to_dict(self):
+        """Everything except the body, for serializing as JSON."""
+        return {
+            'status': self.status,
+            'reason': self.reason,
+            'url': self.url,
+            'headers': self.headers,
+            'vary': self.vary,
+            'stored_at': self.stored_at,
+        }
+
+    @classmethod
+    def from_dict(cls, value, body):
+        headers = [tuple(item) for item in value['headers']]
+        return cls(value['status'], value['reason'], value['url'], headers, body,
+                   vary=value['vary'], stored_at=value['stored_at'])
+
+
+class MemoryCache(object):
+    """Keeps responses in memory, evicting the least recently used.
+
+    Responses are evicted when there are more than max_entries or the bodies
+    add up to more than max_bytes.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Most recently used entries are at the end.
+                self._entries[key] = entry
+
+        return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._discard(key)
+
+            if entry.size > self.max_bytes:
+                return
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class SQLiteCache(object):
+    """Keeps responses in an SQLite database, evicting the least recently used.
+
+    Responses are evicted when there are more than max_entries or the bodies
+    add up to more than max_bytes.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=1024 * 1024 * 1024):
+        # Not every platform has sqlite3 (App Engine doesn't).
+        import sqlite3
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._binary = sqlite3.Binary
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY, entry TEXT, body BLOB, size INTEGER, accessed REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT entry, body FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        value, body = row
+
+        return CacheEntry.from_dict(simplejson.loads(value), bytes(body))
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            self.delete(key)
+            return
+
+        value = simplejson.dumps(entry.to_dict())
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, entry, body, size, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, value, self._binary(entry.body), entry.size, time.time()),
+            )
+
+            while True:
+                count, total = self._db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+                ).fetchone()
+
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+
+                self._db.execute(
+                    'DELETE FROM responses WHERE key = '
+                    '(SELECT key FROM responses ORDER BY accessed LIMIT 1)'
+                )
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+
+    def close(self):
+        self._db.close()
+
+
+_cacheable_methods = ('GET', 'HEAD')
+_body_headers = ('content-encoding', 'content-length', 'transfer-encoding')
+_cacheable_codes = (200, 203, 300, 301, 410)
+
+
+def _parse_cache_control(value):
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"')
+
+    return directives
+
+
+def _parse_http_date(value):
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+
+    return email.utils.mktime_tz(parsed)
+
+
+def _header_items(message):
+    if six.PY2:
+        return [tuple(v.strip() for v in line.split(':', 1)) for line in message.headers]
+
+    return list(message.items())
+
+
+def _message_from_items(items):
+    value = ''.join('%s: %s\r\n' % item for item in items) + '\r\n'
+    fp = io.BytesIO(value.encode(LATIN1))
+
+    if six.PY2:
+        return http_client.HTTPMessage(fp)
+
+    return http_client.parse_headers(fp)
+
+
+def _cache_key(request):
+    return '%s %s' % (request.get_method(), request.get_full_url())
+
+
+def _freshness_lifetime(headers):
+    """Seconds that a response is fresh for, or None."""
+    directives = _parse_cache_control(headers.get('Cache-Control'))
+
+    if 'no-cache' in directives:
+        return 0
+
+    if 'max-age' in directives:
+        try:
+            return int(directives['max-age'])
+        except ValueError:
+            return 0
+
+    expires = _parse_http_date(headers.get('Expires'))
+    if expires is not None:
+        date = _parse_http_date(headers.get('Date')) or time.time()
+        return expires - date
+
+
+def _is_fresh(entry):
+    headers = _message_from_items(entry.headers)
+    lifetime = _freshness_lifetime(headers)
+    if lifetime is None:
+        return False
+
+    try:
+        age = int(headers.get('Age') or 0)
+    except ValueError:
+        age = 0
+
+    return age + (time.time() - entry.stored_at) < lifetime
+
+
+def _vary_values(request, names):
+    return {name: request.get_header(name.capitalize()) for name in names}
+
+
+def _usable_cache(cache, request):
+    """Returns the cache, or None if the request can't use the cache."""
+    if request.get_method() not in _cacheable_methods:
+        return None
+
+    # If the caller sent their own conditional request, the response is theirs.
+    if request.has_header('If-none-match') or request.has_header('If-modified-since'):
+        return None
+
+    if 'no-store' in _parse_cache_control(request.get_header('Cache-control')):
+        return None
+
+    return cache
+
+
+def _add_validators(request, entry):
+    headers = _message_from_items(entry.headers)
+
+    if headers.get('ETag'):
+        request.add_header('If-none-match', headers['ETag'])
+
+    if headers.get('Last-Modified'):
+        request.add_header('If-modified-since', headers['Last-Modified'])
+
+
+def _cache_lookup(cache, request):
+    """Returns a matching cache entry for the request, or None."""
+    # The caller wants a response from the server, but it can still be saved.
+    if 'no-cache' in _parse_cache_control(request.get_header('Cache-control')):
+        return None
+
+    key = _cache_key(request)
+    entry = cache.get(key)
+
+    if entry is not None and entry.vary != _vary_values(request, entry.vary):
+        entry = None
+
+    return entry
+
+
+def _response_from_cache(entry, request, headers=None):
+    headers = _message_from_items(entry.headers) if headers is None else headers
+    raw = _BufferedResponse(entry.status, entry.reason, headers, entry.url, entry.body)
+    response = _build_response(raw, request)
+    response.from_cache = True
+
+    return response
+
+
+def _cache_store(cache, request, response):
+    """Saves the response if it can be cached, and returns the response."""
+    headers = response.headers
+    directives = _parse_cache_control(headers.get('Cache-Control'))
+    vary = [name.strip() for name in (headers.get('Vary') or '').split(',') if name.strip()]
+
+    cacheable = (
+        response.status_code in _cacheable_codes
+        # Don't store the response for one URL under the URL that redirected.
+        and response.url == request.get_full_url()
+        and 'no-store' not in directives
+        and '*' not in vary
+        and (
+            _freshness_lifetime(headers) is not None
+            or 'ETag' in headers
+            or 'Last-Modified' in headers
+        )
+    )
+
+    if cacheable:
+        entry = CacheEntry(
+            response.status_code,
+            response.raw.msg,
+            response.url,
+            # The body is stored decompressed.
+            [item for item in _header_items(headers) if item[0].lower() not in _body_headers],
+            response.content,
+            vary=_vary_values(request, vary),
+        )
+        cache.set(_cache_key(request), entry)
+
+    return response
+
+
+def _cache_revalidated(cache, request, response, entry):
+    """Updates the entry from a 304 response and returns the cached response."""
+    # Read the (empty) body so the connection is released.
+    response.content
+
+    headers = [item for item in _header_items(response.headers) if item[0].lower() not in _body_headers]
+    replaced = set(name.lower() for name, _ in headers)
+    entry.headers = [item for item in entry.headers if item[0].lower() not in replaced] + headers
+    entry.stored_at = time.time()
+    cache.set(_cache_key(request), entry)
+
+    return _response_from_cache(entry, request)
+
+
+_decompress_wbits = {
+    'deflate': zlib.MAX_WBITS,
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+}
+
+
+def _iter_decompress(chunks, encoding):
+    """Decompresses a gzip or deflate body a piece at a time."""
+    decompressor = None
+    if encoding != 'deflate':
+        decompressor = zlib.decompressobj(_decompress_wbits[encoding])
+
+    pending = b''
+
+    for chunk in chunks:
+        if decompressor is None:
+            # Some servers send raw deflate data without the zlib header. The
+            # header is 2 bytes, and chunks may be smaller than that.
+            pending += chunk
+            if len(pending) < 2:
+                continue
+
+            decompressor = _deflate_decompressor(pending[:2])
+            chunk, pending = pending, b''
+
+        for value in _decompress_chunk(decompressor, chunk):
+            yield value
+
+    if decompressor is None:
+        decompressor = _deflate_decompressor(pending)
+        for value in _decompress_chunk(decompressor, pending):
+            yield value
+
+    value = decompressor.flush()
+    if value:
+        yield value
+
+
+def _deflate_decompressor(header):
+    try:
+        zlib.decompressobj(zlib.MAX_WBITS).decompress(header)
+    except zlib.error:
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+    return zlib.decompressobj(zlib.MAX_WBITS)
+
+
+def _decompress_chunk(decompressor, chunk):
+    # Limit the size of each piece so a small chunk can't decompress to a
+    # huge string.
+    while chunk:
+        value = decompressor.decompress(chunk, _chunk_size)
+        chunk = decompressor.unconsumed_tail
+        if value:
+            yield value
+
+
+def _iter_limit(chunks, max_size):
+    total = 0
+
+    for chunk in chunks:
+        total += len(chunk)
+        if total > max_size:
+            raise HTTPError('Response body is larger than %d bytes' % max_size)
+        yield chunk
+
+
+def _iter_decode(chunks, encoding, errors='replace'):
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+
+    for chunk in chunks:
+        value = decoder.decode(chunk)
+        if value:
+            yield value
+
+    value = decoder.decode(b'', final=True)
+    if value:
+        yield value
+
+
+class JSONCodec(object):
+    """Encodes and decodes JSON with the standard library json module.
+
+    Sub-class this to use another JSON library. dumps() returns UTF-8 bytes
+    and loads() accepts bytes or text. Both take the same keyword arguments
+    as the json module.
+    """
+    name = 'json'
+
+    def dumps(self, value, **kwargs):
+        return simplejson.dumps(value, **kwargs).encode('utf-8')
+
+    def loads(self, value, **kwargs):
+        # json.loads() accepts bytes on Python 3.6 and later, but still
+        # decodes them to text. Only orjson and ujson avoid that copy.
+        if isinstance(value, bytes) and not _json_accepts_bytes:
+            value = value.decode(detect_encoding(value[:4]))
+
+        return simplejson.loads(value, **kwargs)
+
+
+class UjsonCodec(JSONCodec):
+    """Encodes and decodes JSON with ujson.
+
+    Keyword arguments for the json module are passed to the json module, as
+    is JSON that ujson rejects, such as NaN or very big integers.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, value, **kwargs):
+        if kwargs:
+            return super(UjsonCodec, self).dumps(value, **kwargs)
+
+        return self._ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+    def loads(self, value, **kwargs):
+        if not kwargs:
+            try:
+                return self._ujson.loads(value)
+            except ValueError:
+                pass
+
+        return super(UjsonCodec, self).loads(value, **kwargs)
+
+
+class OrjsonCodec(JSONCodec):
+    """Encodes and decodes JSON with orjson.
+
+    Keyword arguments for the json module are passed to the json module, as
+    are values that orjson cannot encode, such as dicts with integer keys,
+    and JSON that orjson rejects, such as NaN and Infinity.
+
+    orjson decodes integers bigger than 64 bits as floats, losing precision,
+    and encodes NaN and Infinity as null.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, value, **kwargs):
+        if not kwargs:
+            try:
+                return self._orjson.dumps(value)
+            except TypeError:
+                pass
+
+        return super(OrjsonCodec, self).dumps(value, **kwargs)
+
+    def loads(self, value, **kwargs):
+        if not kwargs:
+            try:
+                return self._orjson.loads(value)
+            except ValueError:
+                pass
+
+        return super(OrjsonCodec, self).loads(value, **kwargs)
+
+
+_json_codecs = {}
+_default_json_codec = None
+
+
+def register_json_codec(codec, default=False):
+    """Makes a JSONCodec available by name, and optionally the default."""
+    global _default_json_codec
+
+    _json_codecs[codec.name] = codec
+    if default or _default_json_codec is None:
+        _default_json_codec = codec
+
+
+def get_json_codec(codec=None):
+    """Returns the JSONCodec for codec, which is a codec, a name or None.
+
+    With None it returns the default, which is the json module unless another
+    codec was registered with default=True.
+    """
+    if codec is None:
+        return _default_json_codec
+
+    if isinstance(codec, six.string_types):
+        try:
+            return _json_codecs[codec]
+        except KeyError:
+            raise ValueError('Unknown JSON codec %r, use one of %s' % (codec, ', '.join(sorted(_json_codecs))))
+
+    return codec
+
+
+register_json_codec(JSONCodec())
+
+# Faster libraries are used only when asked for, because their results are
+# not always the same as the json module's.
+for _codec_class in (UjsonCodec, OrjsonCodec):
+    try:
+        register_json_codec(_codec_class())
+    except ImportError:
+        pass
+
+
+class _JSONStream(object):
+    # Decodes values from JSON text which arrives in pieces. Only the value
+    # being decoded (and one piece of text) is kept in memory.
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _number_chars = re.compile(r'[0-9.eE+-]*')
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = u''
+        self._pos = 0
+        self._decoder = simplejson.JSONDecoder()
+
+    def _fill(self):
+        """Reads more text, at least doubling the buffer. False at the end."""
+        buffer = [self._buffer[self._pos:]]
+        wanted = max(len(buffer[0]), 1)
+        size = 0
+
+        for chunk in self._chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= wanted:
+                break
+
+        self._buffer = u''.join(buffer)
+        self._pos = 0
+
+        return size > 0
+
+    def _peek(self):
+        """Returns the next character after whitespace, or '' at the end."""
+        while True:
+            self._pos = self._whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                return u''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expected %r at %r' % (char, self._buffer[self._pos:self._pos + 20]))
+
+        self._pos += 1
+
+    def _decode(self):
+        self._peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # The value is incomplete, unless we are at the end.
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer may continue in the next piece.
+            tail = self._number_chars.match(self._buffer, end).end()
+            if tail == len(self._buffer) and self._fill():
+                continue
+
+            self._pos = end
+
+            return value
+
+    def _find(self, key):
+        # Skips through an object to the value for the key.
+        self._expect(u'{')
+
+        while self._peek() != u'}':
+            name = self._decode()
+            self._expect(u':')
+
+            if name == key:
+                return
+
+            self._decode()
+
+            if self._peek() == u',':
+                self._pos += 1
+
+        raise KeyError(key)
+
+    def iter_items(self, path):
+        for key in path:
+            self._find(key)
+
+        self._expect(u'[')
+
+        if self._peek() == u']':
+            return
+
+        while True:
+            yield self._decode()
+
+            char = self._peek()
+            self._pos += 1
+
+            if char == u']':
+                return
+            elif char != u',':
+                raise ValueError('Expected "," or "]" at %r' % self._buffer[self._pos - 1:self._pos + 20])
+
+
+def detect_encoding(value):
+    """Returns the character encoding for a JSON string."""
+    # https://tools.ietf.org/html/rfc4627#section-3
+    if six.PY2:
+        null_pattern = tuple(bool(ord(char)) for char in value[:4])
+    else:
+        null_pattern = tuple(bool(char) for char in value[:4])
+
+    encodings = {
+        # Zero is a null-byte, 1 is anything else.
+        (0, 0, 0, 1): 'utf-32-be',
+        (0, 1, 0, 1): 'utf-16-be',
+        (1, 0, 0, 0): 'utf-32-le',
+        (1, 0, 1, 0): 'utf-16-le',
+    }
+
+    return encodings.get(null_pattern, 'utf-8')
+
+
+def _create_ssl_context(verify=True):
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+
+    if hasattr(context, 'set_alpn_protocols'):
+        context.set_alpn_protocols(['http/1.1'])
+
+    return context
+
+
+def _ssl_context(verify=True):
+    """Returns a shared SSL context, or verify if it is an SSLContext."""
+    # Creating a context loads the CA certificates, which is slow, so there
+    # is one context for verify=True and one for verify=False.
+    if isinstance(verify, ssl.SSLContext):
+        return verify
+
+    verify = bool(verify)
+    context = _ssl_contexts.get(verify)
+    if context is None:
+        context = _ssl_contexts.setdefault(verify, _create_ssl_context(verify))
+
+    return context
+
+
+def _make_opener(allow_redirects, ssl_context):
+    # We need a custom opener so we can choose to not follow redirects and
+    # not treat 4xx and 5xx responses as errors.
+    handlers = [HTTPErrorHandler, HTTPHandler, HTTPSHandler(context=ssl_context)]
+    if not allow_redirects:
+        handlers.append(HTTPRedirectHandler)
+
+    opener = urllib.request.build_opener(*handlers)
+
+    return opener
+
+
+def _build_opener(allow_redirects=True, verify=True):
+    """Returns a shared opener for the options.
+
+    The verify argument can be a boolean or an ssl.SSLContext.
+    """
+    ssl_context = _ssl_context(verify)
+    key = (bool(allow_redirects), ssl_context)
+    opener = _openers.get(key)
+
+    if opener is None:
+        # Avoid keeping every SSL context we were ever given.
+        if len(_openers) >= _max_openers:
+            _openers.clear()
+
+        opener = _make_opener(allow_redirects, ssl_context)
+        opener = _openers.setdefault(key, opener)
+
+    return opener
+
+
+def _encode_basic_auth(name, password):
+    value = ('%s:%s' % (name, password)).encode(LATIN1).strip()
+    value = b'Basic ' + base64.b64encode(value)
+
+    return value
+
+
+def _encode_data(data):
+    """Handle a mapping or a sequence of pairs."""
+    return urllib.parse.urlencode(data, doseq=True)
+
+
+def _guess_filename(fileobj):
+    name = getattr(fileobj, 'name', None)
+    if name and name[:1] != '<' and name[-1:] != '>':
+        return os.path.basename(name)
+
+
+def _file_size(fileobj):
+    """Returns the number of bytes left to read from fileobj, or None."""
+    fileno = _fileno(fileobj)
+    if fileno is not None:
+        stat = os.fstat(fileno)
+
+        # Pipes and sockets don't have a size.
+        if not S_ISREG(stat.st_mode):
+            return None
+
+        return max(stat.st_size - fileobj.tell(), 0)
+
+    try:
+        position = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        end = fileobj.tell()
+        fileobj.seek(position)
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+    return end - position
+
+
+class MultipartBody(object):
+    """A multipart/form-data body which reads files as it is sent.
+
+    Segments are byte strings or file objects. If the size of every file can
+    be worked out then length is the size of the body, otherwise length is
+    None and the body is sent with chunked transfer encoding.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.sizes = [
+            len(segment) if isinstance(segment, six.binary_type) else _file_size(segment)
+            for segment in segments
+        ]
+
+        self._positions = [
+            None if isinstance(segment, six.binary_type) else _tell(segment)
+            for segment in segments
+        ]
+
+        if None in self.sizes:
+            self.length = None
+        else:
+            self.length = sum(self.sizes)
+
+    def rewind(self):
+        """Seeks files back to where they started. False if one cannot be."""
+        for segment, position in zip(self.segments, self._positions):
+            if isinstance(segment, six.binary_type):
+                continue
+
+            if position is None:
+                return False
+
+            segment.seek(position)
+
+        return True
+
+    def __iter__(self):
+        for segment, size in zip(self.segments, self.sizes):
+            if isinstance(segment, six.binary_type):
+                yield segment
+            else:
+                for chunk in _iter_file(segment, size):
+                    yield chunk
 
-    return encodings.get(null_pattern, 'utf-8')
+    def send(self, sock):
+        """Writes the body to a socket. The length must be known.
 
+        Regular files are sent with sendfile() on plain sockets, so their
+        contents are not copied into Python. Otherwise files are read into a
+        buffer which is re-used for every chunk.
+        """
+        use_sendfile = hasattr(sock, 'sendfile') and not isinstance(sock, ssl.SSLSocket)
+        view = None
 
-def _build_opener(allow_redirects=True, verify=True):
-    # We need a custom opener so we can choose to not follow redirects and
-    # not treat 4xx and 5xx responses as errors.
-    handlers = [HTTPErrorHandler]
-    if not allow_redirects:
-        handlers.append(HTTPRedirectHandler)
+        for segment, size in zip(self.segments, self.sizes):
+            if isinstance(segment, six.binary_type):
+                sock.sendall(segment)
 
-    if not verify:
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        handler = urllib.request.HTTPSHandler(context=ssl_context)
-        handlers.append(handler)
+            elif use_sendfile and _fileno(segment) is not None:
+                sent = sock.sendfile(segment, segment.tell(), size)
+                if sent != size:
+                    raise IOError('File ended before the expected size: %r' % segment)
 
-    opener = urllib.request.build_opener(*handlers)
+            elif hasattr(segment, 'readinto'):
+                if view is None:
+                    view = memoryview(bytearray(_chunk_size))
 
-    return opener
+                remaining = size
+                while remaining:
+                    count = segment.readinto(view[:min(remaining, _chunk_size)])
+                    if not count:
+                        raise IOError('File ended before the expected size: %r' % segment)
 
+                    sock.sendall(view[:count])
+                    remaining -= count
 
-def _encode_basic_auth(name, password):
-    value = ('%s:%s' % (name, password)).encode(LATIN1).strip()
-    value = b'Basic ' + base64.b64encode(value)
+            else:
+                for chunk in _iter_file(segment, size):
+                    sock.sendall(chunk)
 
-    return value
 
+def _fileno(fileobj):
+    try:
+        return fileobj.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
 
-def _encode_data(data):
-    """Handle a mapping or a sequence of pairs."""
-    return urllib.parse.urlencode(data, doseq=True)
 
+def _iter_file(fileobj, size=None):
+    """Reads fileobj in chunks, stopping after size bytes if size is given."""
+    remaining = size
 
-def _guess_filename(fileobj):
-    name = getattr(fileobj, 'name', None)
-    if name and name[:1] != '<' and name[-1:] != '>':
-        return os.path.basename(name)
+    while remaining is None or remaining > 0:
+        chunk_size = _chunk_size if remaining is None else min(_chunk_size, remaining)
+        chunk = fileobj.read(chunk_size)
+
+        if not chunk:
+            if remaining:
+                # We already sent a Content-Length header, so can't recover.
+                raise IOError('File ended before the expected size: %r' % fileobj)
+            break
+
+        if remaining is not None:
+            remaining -= len(chunk)
+
+        yield chunk
 
 
 def _choose_boundary():
@@ -285,9 +2655,7 @@ def _build_form_data(data=None, files=None):
 
             content_type = (mimetypes.guess_type(name)[0] or BINARY_TYPE).encode(LATIN1)
 
-            if not isinstance(value, six.binary_type):
-                value = value.read()
-
+            # File objects are read as the body is sent.
             parts.extend([
                 parts_boundary,
                 ('Content-Disposition: file; name="%s"; filename="%s"' % (field_name, name)).encode(LATIN1),
@@ -302,7 +2670,21 @@ def _build_form_data(data=None, files=None):
     ])
 
     content_type = b'multipart/form-data; boundary=' + boundary
-    data = b'\r\n'.join(parts)
+
+    # Join the parts with line breaks, except for file objects.
+    segments = []
+    pending = []
+    for part in parts:
+        if isinstance(part, six.binary_type):
+            pending.append(part)
+        else:
+            pending.append(b'')
+            segments.extend([b'\r\n'.join(pending), part])
+            pending = [b'']
+
+    data = b'\r\n'.join(pending)
+    if segments:
+        data = MultipartBody(segments + [data])
 
     return content_type, data
 
@@ -329,6 +2711,52 @@ def build_cookie(name, value):
     )
 
 
+class CookieJar(http_cookiejar.LWPCookieJar):
+    """Keeps the cookies for a session.
+
+    Cookies are kept by domain and path, and only the domains which could
+    match a request's host are checked when sending cookies.
+
+    Use save() and load() to keep cookies in a file between runs. Cookies
+    without an expiry date are only saved with save(ignore_discard=True).
+    """
+
+    def add_cookie_header(self, request):
+        # Cookies given for the request win over cookies in the jar with the
+        # same name.
+        given = request.unredirected_hdrs.pop('Cookie', None)
+        http_cookiejar.LWPCookieJar.add_cookie_header(self, request)
+
+        if given:
+            names = {pair.partition('=')[0].strip() for pair in given.split(';')}
+            header = request.unredirected_hdrs.get('Cookie')
+            pairs = header.split('; ') if header else []
+            pairs = [given] + [pair for pair in pairs if pair.partition('=')[0] not in names]
+            request.add_unredirected_header('Cookie', '; '.join(pairs))
+
+    def _cookies_for_request(self, request):
+        cookies = []
+        for domain in _cookie_domains(request):
+            if domain in self._cookies:
+                cookies.extend(self._cookies_for_domain(domain, request))
+
+        return cookies
+
+
+def _cookie_domains(request):
+    """Returns the cookie domains which could match the request's host."""
+    hosts = {http_cookiejar.request_host(request), http_cookiejar.eff_request_host(request)[1]}
+    domains = {''}
+
+    for host in hosts:
+        parts = host.split('.')
+        for n in range(len(parts)):
+            suffix = '.'.join(parts[n:])
+            domains.update([suffix, '.' + suffix])
+
+    return domains
+
+
 def _merge_params(url, params):
     """Merge and encode query parameters with an URL."""
     if isinstance(params, dict):
@@ -343,53 +2771,486 @@ def _merge_params(url, params):
     return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
 
 
+def _group_params(params):
+    """Returns an OrderedDict of the list of values for each name in params."""
+    if isinstance(params, dict):
+        params = params.items()
+
+    grouped = collections.OrderedDict()
+    for name, value in params:
+        values = grouped.setdefault(name, [])
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        else:
+            values.append(value)
+
+    return grouped
+
+
+def _is_iterator(value):
+    return hasattr(value, '__next__') or hasattr(value, 'next')
+
+
+def _iter_bytes(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf-8')
+        yield chunk
+
+
+def _iter_json_lines(values, codec):
+    """Encodes values as newline-delimited JSON, in pieces of about 64KB."""
+    lines = []
+    size = 0
+
+    for value in values:
+        line = codec.dumps(value) + b'\n'
+        lines.append(line)
+        size += len(line)
+
+        if size >= _chunk_size:
+            yield b''.join(lines)
+            lines = []
+            size = 0
+
+    if lines:
+        yield b''.join(lines)
+
+
 def _build_request(method, url, params=None, data=None, headers=None,
-            cookies=None, auth=None, json=None, files=None):
-    headers = {k.lower(): v for k, v in headers.items()} if headers else {}
-    headers.setdefault('user-agent', _user_agent)
+            cookies=None, auth=None, json=None, files=None, compress=None,
+            compress_min_size=1024, json_lines=None, json_codec=None):
+    headers = _request_headers(headers, auth)
 
     if params:
         url = _merge_params(url, params)
 
+    data = _build_body(
+        headers,
+        data=data,
+        json=json,
+        files=files,
+        compress=compress,
+        compress_min_size=compress_min_size,
+        json_lines=json_lines,
+        json_codec=json_codec,
+    )
+
+    return _new_request(method, url, data, headers, json_codec, _cookie_header(cookies))
+
+
+def _request_headers(headers, auth):
+    """Returns the headers with lower-case names, and the defaults."""
+    headers = {k.lower(): v for k, v in headers.items()} if headers else {}
+    headers.setdefault('user-agent', _user_agent)
+    headers.setdefault('accept-encoding', _accept_encoding)
+
     if auth:
         name, password = auth
         headers['authorization'] = _encode_basic_auth(name, password)
 
-    if data and not files and not isinstance(data, six.binary_type):
+    return headers
+
+
+def _cookie_header(cookies):
+    if cookies:
+        return '; '.join('%s=%s' % item for item in cookies.items())
+
+
+def _build_body(headers, data=None, json=None, files=None, compress=None,
+                compress_min_size=1024, json_lines=None, json_codec=None):
+    """Returns the request body, and sets the headers which describe it."""
+    if hasattr(data, 'read'):
+        # A file object is read as the body is sent.
+        size = _file_size(data)
+        if size is not None:
+            headers['content-length'] = str(size)
+    elif _is_iterator(data):
+        # Sent with chunked encoding, as the iterator produces it.
+        data = _iter_bytes(data)
+    elif data and not files and not isinstance(data, six.binary_type):
         data = _encode_data(data)
         data = data.encode('ascii')
 
     if json:
         # If you send data and json, json overwrites data.
-        data = simplejson.dumps(json).encode('utf-8')
+        data = get_json_codec(json_codec).dumps(json)
         headers['content-type'] = JSON_TYPE
 
+    if json_lines is not None:
+        data = _iter_json_lines(json_lines, get_json_codec(json_codec))
+        headers['content-type'] = NDJSON_TYPE
+
     if files:
         content_type, data = _build_form_data(data, files)
         headers['content-type'] = content_type
 
+        # Without a length, urllib sends the body with chunked encoding.
+        if isinstance(data, MultipartBody) and data.length is not None:
+            headers['content-length'] = str(data.length)
+
+    if compress and data is not None:
+        compressed = _compress_body(data, compress, compress_min_size)
+
+        if compressed is not None:
+            data = compressed
+            headers['content-encoding'] = compress
+            headers.pop('content-length', None)
+
+    return data
+
+
+def _new_request(method, url, data, headers, json_codec, cookie_header):
     request = Request(method, url, data=data, headers=headers)
+    request.json_codec = json_codec
 
-    if cookies:
-        jar = http_cookiejar.CookieJar()
-        for key, value in cookies.items():
-            cookie = build_cookie(key, value)
-            jar.set_cookie(cookie)
+    if hasattr(data, 'read'):
+        request.body_position = _tell(data)
 
-        jar.add_cookie_header(request)
+    if cookie_header and not request.has_header('Cookie'):
+        request.add_unredirected_header('Cookie', cookie_header)
 
     return request
 
 
-def _build_response(urllib_response, request):
-    response = Response(urllib_response, request)
+# The arguments of request() which are used for sending, not building, the
+# request.
+_send_options = frozenset([
+    'allow_redirects',
+    'cache',
+    'deadline',
+    'dns_cache',
+    'hedge',
+    'hooks',
+    'max_content_size',
+    'max_redirects',
+    'redirect_cache',
+    'retries',
+    'session',
+    'stream',
+    'timeout',
+    'verify',
+])
+
+
+def _check_send_options(kwargs):
+    for name in kwargs:
+        if name not in _send_options:
+            raise TypeError('Unexpected keyword argument %r' % name)
+
+
+class RequestTemplate(object):
+    """A request with the parts which don't change worked out in advance.
+
+    Call it with the arguments which change from one request to the next,
+    usually params and the body. Made by prepare().
+    """
+
+    def __init__(self, method, url, params=None, data=None, headers=None, cookies=None,
+                 auth=None, json=None, files=None, compress=None, compress_min_size=1024,
+                 json_lines=None, json_codec=None, **kwargs):
+        _check_send_options(kwargs)
+
+        session = kwargs.get('session')
+        if session is not None and json_codec is None:
+            json_codec = session.json_codec
+
+        if params:
+            url = _merge_params(url, params)
+
+        scheme, netloc, path, query, fragment = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qsl(query, keep_blank_values=True)
+
+        self.method = method
+        self.url = url
+        self._base_url = urllib.parse.urlunsplit((scheme, netloc, path, '', ''))
+        self._params = _group_params(query)
+        self._query = _encode_data(query)
+        self._fragment = fragment
+        self._headers = _request_headers(headers, auth)
+        self._cookie_header = _cookie_header(cookies)
+        self._data = data
+        self._json = json
+        self._files = files
+        self._json_lines = json_lines
+        self._compress = compress
+        self._compress_min_size = compress_min_size
+        self._json_codec = json_codec
+        self._kwargs = kwargs
+
+    def __call__(self, params=None, data=None, headers=None, cookies=None, auth=None,
+                 json=None, files=None, compress=None, compress_min_size=None,
+                 json_lines=None, json_codec=None, **kwargs):
+        """Makes the request. Keyword arguments are the same as for request(),
+        and override the template's.
+        """
+        _check_send_options(kwargs)
+
+        request = self.build(
+            params,
+            data=data,
+            headers=headers,
+            cookies=cookies,
+            auth=auth,
+            json=json,
+            files=files,
+            compress=compress,
+            compress_min_size=compress_min_size,
+            json_lines=json_lines,
+            json_codec=json_codec,
+        )
+
+        if kwargs:
+            kwargs = dict(self._kwargs, **kwargs)
+        else:
+            kwargs = self._kwargs
+
+        return _send_request(request, **kwargs)
+
+    def build(self, params=None, data=None, headers=None, cookies=None, auth=None,
+              json=None, files=None, compress=None, compress_min_size=None,
+              json_lines=None, json_codec=None):
+        """Returns the Request, without sending it."""
+        query = self._query
+        if params:
+            params = _group_params(params)
+
+            if query and any(name in self._params for name in params):
+                # Replaces the template's values for the same names.
+                merged = self._params.copy()
+                merged.update(params)
+                query = _encode_data(merged)
+            else:
+                extra = _encode_data(params)
+                query = query + '&' + extra if query else extra
+
+        url = self._base_url
+        if query:
+            url = url + '?' + query
+        if self._fragment:
+            url = url + '#' + self._fragment
+
+        request_headers = self._headers.copy()
+        if headers:
+            request_headers.update((k.lower(), v) for k, v in headers.items())
+
+        if auth:
+            name, password = auth
+            request_headers['authorization'] = _encode_basic_auth(name, password)
+
+        cookie_header = self._cookie_header if cookies is None else _cookie_header(cookies)
+        json_codec = self._json_codec if json_codec is None else json_codec
+
+        data = _build_body(
+            request_headers,
+            data=self._data if data is None else data,
+            json=self._json if json is None else json,
+            files=self._files if files is None else files,
+            compress=self._compress if compress is None else compress,
+            compress_min_size=self._compress_min_size if compress_min_size is None else compress_min_size,
+            json_lines=self._json_lines if json_lines is None else json_lines,
+            json_codec=json_codec,
+        )
+
+        return _new_request(self.method, url, data, request_headers, json_codec, cookie_header)
+
+
+def prepare(method, url, **kwargs):
+    """Returns a RequestTemplate, for making many similar requests quickly.
+
+    The arguments are the same as for request(). The URL, headers, auth and
+    cookies are worked out once instead of for every request. A body given
+    here is sent with every request, so it should be bytes, a dict or JSON,
+    not a file or a generator which can only be read once.
+
+        >>> get_item = notrequests.prepare('GET', 'https://example.com/items', auth=auth)
+        >>> response = get_item(params={'id': 1})
+    """
+    return RequestTemplate(method, url, **kwargs)
+
+
+_compress_wbits = {
+    'deflate': zlib.MAX_WBITS,
+    'gzip': 16 + zlib.MAX_WBITS,
+}
+
+
+def _iter_compress(chunks, encoding):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _compress_wbits[encoding])
+
+    for chunk in chunks:
+        value = compressor.compress(chunk)
+        if value:
+            yield value
+
+    yield compressor.flush()
+
+
+class CompressedBody(object):
+    """Compresses a streamed request body as it is sent."""
+
+    def __init__(self, body, encoding):
+        self.body = body
+        self.encoding = encoding
+        self._position = _tell(body) if hasattr(body, 'read') else None
+
+    def __iter__(self):
+        body = self.body
+        if hasattr(body, 'read'):
+            # Iterating over a file reads lines, which could be any size.
+            body = _iter_bytes(_iter_file(body))
+
+        return _iter_compress(body, self.encoding)
+
+    def rewind(self):
+        """Rewinds the body to be compressed again. False if it cannot be."""
+        rewind = getattr(self.body, 'rewind', None)
+        if rewind is not None:
+            return rewind()
+
+        if self._position is not None:
+            self.body.seek(self._position)
+            return True
+
+        # Iterators can only be read once.
+        return not _is_iterator(self.body)
+
+
+def _compress_body(data, encoding, min_size):
+    """Returns the compressed body, or None if it is too small to bother."""
+    if encoding not in _compress_wbits:
+        raise ValueError('Cannot compress with %r, use "gzip" or "deflate"' % encoding)
+
+    if isinstance(data, six.binary_type):
+        if len(data) < min_size:
+            return None
+
+        return b''.join(_iter_compress([data], encoding))
+
+    # Bodies of unknown length are always compressed.
+    length = getattr(data, 'length', None)
+    if length is not None and length < min_size:
+        return None
+
+    return CompressedBody(data, encoding)
+
+
+_redirect_codes = (301, 302, 303, 307, 308)
+_permanent_redirect_codes = (301, 308)
+_max_redirects = 10
+
+# Headers which describe the body, or only make sense for the original URL.
+_redirect_drop_headers = (
+    'content-encoding',
+    'content-length',
+    'content-type',
+    'if-modified-since',
+    'if-none-match',
+    'transfer-encoding',
+)
+
+
+def _redirect_request(request, status, location):
+    """Returns the request to make to follow a redirect response."""
+    url = urllib.parse.urljoin(request.get_full_url(), location)
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in _default_ports:
+        raise HTTPError('Cannot follow redirect to %s' % url)
+
+    method = request.get_method()
+    data = request.data
+    headers = dict(request.headers)
+
+    # Like browsers, a 303 (and a 301 or 302 for a POST) becomes a GET
+    # without the body. Otherwise the method and body are kept.
+    if (status == 303 and method != 'HEAD') or (status in (301, 302) and method == 'POST'):
+        method = 'GET'
+        data = None
+        headers = {k: v for k, v in headers.items() if k.lower() not in _redirect_drop_headers}
+    else:
+        headers = {k: v for k, v in headers.items() if not k.lower().startswith('if-')}
+
+        if data is not None and not _rewind_body(request):
+            raise HTTPError('Cannot send the body again to follow the redirect to %s' % url)
+
+    # Credentials are only for the host they were given for, and not sent
+    # over plain HTTP if they were given for HTTPS.
+    original = urllib.parse.urlsplit(request.get_full_url())
+    if parts.netloc != original.netloc or (original.scheme, parts.scheme) == ('https', 'http'):
+        headers.pop('Authorization', None)
+
+    redirect = Request(method, url, data=data, headers=headers)
+    redirect.pool = getattr(request, 'pool', None)
+    redirect.json_codec = getattr(request, 'json_codec', None)
+    redirect.dns_cache = getattr(request, 'dns_cache', None)
+    redirect.body_position = getattr(request, 'body_position', None)
+
+    return redirect
+
+
+class RedirectCache(object):
+    """Remembers permanent redirects (301 and 308), so requests for the old
+    URL go straight to the new one.
+
+    At most maxsize redirects are kept, forgetting the least recently used.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._redirects = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._redirects)
+
+    def get(self, url):
+        """Returns (status, location) for a URL that was redirected, or None."""
+        with self._lock:
+            value = self._redirects.pop(url, None)
+            if value is not None:
+                self._redirects[url] = value
+
+            return value
+
+    def put(self, url, status, location):
+        with self._lock:
+            self._redirects.pop(url, None)
+            self._redirects[url] = (status, location)
+
+            while len(self._redirects) > self.maxsize:
+                self._redirects.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._redirects.clear()
+
+    def _follow(self, request, max_redirects):
+        for _ in range(max_redirects):
+            redirect = self.get(request.get_full_url())
+            if redirect is None:
+                break
+
+            request = _redirect_request(request, *redirect)
+
+        return request
+
+
+def _build_response(urllib_response, request, stream=False, max_content_size=None):
+    response = Response(urllib_response, request, stream=stream, max_content_size=max_content_size)
 
     return response
 
 
 def request(method, url, params=None, data=None, headers=None, cookies=None,
             auth=None, json=None, files=None, allow_redirects=True, verify=True,
-            timeout=None):
+            timeout=None, session=None, stream=False, cache=None,
+            max_content_size=None, compress=None, compress_min_size=1024,
+            json_lines=None, json_codec=None, retries=None, hedge=None,
+            deadline=None, hooks=None, dns_cache=None, max_redirects=None,
+            redirect_cache=None):
+    if session is not None:
+        json_codec = session.json_codec if json_codec is None else json_codec
+
     request = _build_request(
         method,
         url,
@@ -400,17 +3261,193 @@ def request(method, url, params=None, data=None, headers=None, cookies=None,
         auth=auth,
         json=json,
         files=files,
+        compress=compress,
+        compress_min_size=compress_min_size,
+        json_lines=json_lines,
+        json_codec=json_codec,
+    )
+
+    return _send_request(
+        request,
+        allow_redirects=allow_redirects,
+        verify=verify,
+        timeout=timeout,
+        session=session,
+        stream=stream,
+        cache=cache,
+        max_content_size=max_content_size,
+        retries=retries,
+        hedge=hedge,
+        deadline=deadline,
+        hooks=hooks,
+        dns_cache=dns_cache,
+        max_redirects=max_redirects,
+        redirect_cache=redirect_cache,
     )
 
-    _opener = _build_opener(allow_redirects=allow_redirects, verify=verify)
+
+def _check_body(request):
+    """Raises ValueError if urllib can't send the request body."""
+    # Before Python 3.6 urllib can't send a body with chunked encoding, and
+    # Python 2's httplib only sends byte strings and files.
+    data = request.data
+    if sys.version_info >= (3, 6) or data is None or isinstance(data, six.binary_type):
+        return
+
+    if not request.has_header('Content-length'):
+        raise ValueError('Sending a body without a Content-Length needs Python 3.6 or later')
+
+    if six.PY2 and not (hasattr(data, 'read') or isinstance(data, MultipartBody)):
+        raise ValueError('Sending a body from an iterator needs Python 3')
+
+
+def _send_request(request, allow_redirects=True, verify=True, timeout=None, session=None,
+                  stream=False, cache=None, max_content_size=None, retries=None, hedge=None,
+                  deadline=None, hooks=None, dns_cache=None, max_redirects=None,
+                  redirect_cache=None):
+    """Sends a Request, following redirects, and returns the Response."""
+    url = request.get_full_url()
+
+    if session is not None:
+        dns_cache = session.dns_cache if dns_cache is None else dns_cache
+        retries = session.retries if retries is None else retries
+        hedge = session.hedge if hedge is None else hedge
+        redirect_cache = session.redirect_cache if redirect_cache is None else redirect_cache
+        hooks = _merge_hooks(session.hooks, hooks)
+    else:
+        hooks = _merge_hooks(hooks)
+
+    if max_redirects is None:
+        max_redirects = _max_redirects
+
+    request.dns_cache = dns_cache
+
+    jar = None
+    if session is not None:
+        request.pool = session.pool
+        cache = session.cache if cache is None else cache
+        jar = session.cookies
+
+    request = _dispatch_hook('pre_request', hooks, request)
+    _check_body(request)
+
+    # Go straight to where a permanent redirect went before.
+    if allow_redirects and redirect_cache is not None:
+        request = redirect_cache._follow(request, max_redirects)
+
+    entry = None
+    if cache is not None:
+        cache = _usable_cache(cache, request)
+
+    if cache is not None:
+        entry = _cache_lookup(cache, request)
+
+        if entry is not None:
+            if _is_fresh(entry):
+                return _dispatch_hook('response', hooks, _response_from_cache(entry, request))
+
+            _add_validators(request, entry)
+
+    # Redirects are followed here, not by urllib.
+    _opener = _build_opener(allow_redirects=False, verify=verify)
 
     # Better than trying to re-use urllib2's default timeout value. For regular
     # Python a timeout raises socket.timeout but App Engine will raise
     # google.appengine.api.urlfetch_errors.DeadlineExceededError.
+    if deadline is not None or isinstance(timeout, (tuple, list)):
+        timeout = _Timeouts(timeout, deadline)
+
     kwargs = {} if timeout is None else {'timeout': timeout}
-    urllib_response = _opener.open(request, **kwargs)
 
-    return _build_response(urllib_response, request)
+    def send(req):
+        urllib_response = _opener.open(req, **kwargs)
+
+        return _build_response(
+            urllib_response,
+            req,
+            stream=stream,
+            max_content_size=max_content_size,
+        )
+
+    hedge = _hedge_policy(hedge)
+    retry = _retry_policy(retries)
+    history = []
+    current = request
+
+    while True:
+        if jar is not None:
+            jar.add_cookie_header(current)
+
+        response = _send_with_retries(send, current, retry, hedge, timeout)
+
+        if jar is not None:
+            jar.extract_cookies(response.raw, current)
+
+        location = response.headers.get('Location')
+
+        if not (allow_redirects and location and response.status_code in _redirect_codes):
+            break
+
+        if len(history) >= max_redirects:
+            response.raw.close()
+            raise TooManyRedirects('Exceeded %d redirects for %s' % (max_redirects, url))
+
+        # The body of a redirect is not needed, and closing it before reading
+        # it would close the connection.
+        if stream:
+            response.content
+
+        history.append(response)
+        current = _redirect_request(current, response.status_code, location)
+
+        if redirect_cache is not None and response.status_code in _permanent_redirect_codes:
+            redirect_cache.put(response.url, response.status_code, location)
+
+    response.history = history
+
+    if cache is not None:
+        if entry is not None and response.status_code == codes.not_modified:
+            response = _cache_revalidated(cache, request, response, entry)
+        elif not stream:
+            response = _cache_store(cache, request, response)
+
+    return _dispatch_hook('response', hooks, response)
+
+
+def _send_with_retries(send, request, retry, hedge, timeout):
+    """Calls send(request), trying again as the Retry allows."""
+    if hedge is not None and request.get_method() not in hedge.methods:
+        hedge = None
+
+    started = _clock()
+    attempt = 0
+
+    while True:
+        attempt += 1
+
+        try:
+            if hedge is None:
+                response = send(request)
+            else:
+                response = _hedged_send(send, request, hedge)
+        except (EnvironmentError, http_client.HTTPException) as err:
+            if retry is None or not _is_retryable_error(err):
+                raise
+
+            delay = retry._delay(request.get_method(), attempt, _clock() - started, error=err)
+            if not (_in_time(timeout, delay) and _rewind_body(request)):
+                raise
+        else:
+            if retry is None:
+                return response
+
+            delay = retry._delay(request.get_method(), attempt, _clock() - started, response=response)
+            if not (_in_time(timeout, delay) and _rewind_body(request)):
+                return response
+
+            response.raw.close()
+
+        time.sleep(delay)
 
 
 delete = functools.partial(request, 'DELETE')
@@ -419,3 +3456,305 @@ head = functools.partial(request, 'HEAD')
 patch = functools.partial(request, 'PATCH')
 post = functools.partial(request, 'POST')
 put = functools.partial(request, 'PUT')
+
+
+class BatchStats(object):
+    """Totals for the requests made by map() or imap_unordered()."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        """Seconds from the start of the batch until now, or until it finished."""
+        if self.started is None:
+            return 0.0
+
+        finished = _clock() if self.finished is None else self.finished
+
+        return finished - self.started
+
+    @property
+    def requests_per_second(self):
+        elapsed = self.elapsed
+
+        return self.requests / elapsed if elapsed else 0.0
+
+    def _record(self, result):
+        with self._lock:
+            self.requests += 1
+
+            if isinstance(result, Exception):
+                self.errors += 1
+            elif result._content is not None:
+                self.bytes += len(result._content)
+
+
+def _batch_request(item):
+    # An URL, a (method, url) pair or a (method, url, kwargs) tuple.
+    if isinstance(item, six.string_types):
+        return 'GET', item, {}
+
+    if len(item) == 2:
+        method, url = item
+        return method, url, {}
+
+    method, url, kwargs = item
+
+    return method, url, kwargs
+
+
+class _BatchScheduler(object):
+    # Hands out requests to worker threads, keeping at most per_host_limit
+    # requests to each host in progress. Requests for a busy host wait while
+    # requests for other hosts go ahead.
+    max_pending = 1000
+
+    def __init__(self, requests, per_host_limit=None):
+        self._requests = enumerate(requests)
+        self._per_host_limit = per_host_limit
+        self._pending = collections.deque()
+        self._active = collections.Counter()
+        self._condition = threading.Condition()
+        self._exhausted = False
+        self._stopped = False
+
+    def _ready(self, host):
+        return self._per_host_limit is None or self._active[host] < self._per_host_limit
+
+    def _take(self):
+        for position, item in enumerate(self._pending):
+            if self._ready(item[1]):
+                del self._pending[position]
+                return item
+
+        while not self._exhausted and len(self._pending) < self.max_pending:
+            try:
+                index, item = next(self._requests)
+            except StopIteration:
+                self._exhausted = True
+                break
+
+            try:
+                request = _batch_request(item)
+                host = urllib.parse.urlsplit(request[1]).netloc
+            except Exception as exc:
+                # The worker reports the error as the result.
+                request, host = exc, None
+
+            if self._ready(host):
+                return index, host, request
+
+            self._pending.append((index, host, request))
+
+    def next(self):
+        """Returns (index, host, request) or None when there are no more."""
+        with self._condition:
+            while not self._stopped:
+                item = self._take()
+                if item is not None:
+                    self._active[item[1]] += 1
+                    return item
+
+                if self._exhausted and not self._pending:
+                    return None
+
+                self._condition.wait()
+
+    def release(self, host):
+        with self._condition:
+            self._active[host] -= 1
+            self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+_batch_done = object()
+
+
+def _imap(requests, max_workers, per_host_limit, session, stats):
+    scheduler = _BatchScheduler(requests, per_host_limit)
+    results = queue.Queue()
+    close_session = session is None
+    if close_session:
+        session = Session(pool_maxsize=max_workers)
+
+    def worker():
+        try:
+            while True:
+                item = scheduler.next()
+                if item is None:
+                    break
+
+                index, host, request = item
+                try:
+                    if isinstance(request, Exception):
+                        raise request
+                    method, url, kwargs = request
+                    result = session.request(method, url, **kwargs)
+                except Exception as exc:
+                    result = exc
+                finally:
+                    scheduler.release(host)
+
+                stats._record(result)
+                results.put((index, result))
+        finally:
+            results.put(_batch_done)
+
+    stats.started = _clock()
+    threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running:
+            result = results.get()
+            if result is _batch_done:
+                running -= 1
+            else:
+                yield result
+    finally:
+        scheduler.stop()
+        stats.finished = _clock()
+        if close_session:
+            session.close()
+
+
+def imap_unordered(requests, max_workers=10, per_host_limit=None, session=None, stats=None):
+    """Makes requests on a pool of threads, yielding responses as they finish.
+
+    Each item in requests is an URL to GET, a (method, url) pair or a
+    (method, url, kwargs) tuple where kwargs are the arguments for request().
+    A request which fails yields the exception instead of a response.
+
+    At most per_host_limit requests to one host are made at the same time.
+    Connections are re-used through the session, or a new Session for the
+    batch. Pass a BatchStats as stats to get totals for the batch.
+    """
+    stats = BatchStats() if stats is None else stats
+
+    for _, result in _imap(requests, max_workers, per_host_limit, session, stats):
+        yield result
+
+
+def map(requests, max_workers=10, per_host_limit=None, session=None, stats=None):
+    """Like imap_unordered(), but returns a list in the same order as requests."""
+    stats = BatchStats() if stats is None else stats
+    results = sorted(
+        _imap(requests, max_workers, per_host_limit, session, stats),
+        key=lambda result: result[0],
+    )
+
+    return [result for _, result in results]
+
+
+def paginate(url, session=None, prefetch=False, max_pages=None, **kwargs):
+    """Yields the pages of a paginated API, following rel="next" Link headers.
+
+    The keyword arguments are the same as for request(), but params are only
+    used for the first page, because the next link has its own query string.
+    Stops after max_pages pages, or when a page has no next link.
+
+    With prefetch=True the next page is fetched on another thread while you
+    use the current one. Connections are re-used through the session, or a
+    new Session for the pages.
+    """
+    close_session = session is None
+    if close_session:
+        session = Session()
+
+    pending = None
+    seen = set([url])
+
+    try:
+        response = session.get(url, **kwargs)
+        kwargs.pop('params', None)
+        pages = 1
+
+        while True:
+            next_url = _next_link(response)
+            if next_url in seen or (max_pages is not None and pages >= max_pages):
+                next_url = None
+
+            if next_url is not None and prefetch:
+                pending = _Prefetch(session.get, next_url, kwargs)
+
+            yield response
+
+            if next_url is None:
+                break
+
+            seen.add(next_url)
+            pages += 1
+
+            if pending is None:
+                response = session.get(next_url, **kwargs)
+            else:
+                response, pending = pending.result(), None
+    finally:
+        if pending is not None:
+            pending.cancel()
+        if close_session:
+            session.close()
+
+
+def _next_link(response):
+    link = response.links.get('next')
+    if link is None:
+        return None
+
+    return urllib.parse.urljoin(response.url, link['url'])
+
+
+class _Prefetch(object):
+    """Calls func(url, **kwargs) on another thread."""
+
+    def __init__(self, func, url, kwargs):
+        self._func = func
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+        thread = threading.Thread(target=self._run, args=(url, kwargs))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, url, kwargs):
+        try:
+            result = (self._func(url, **kwargs), None)
+        except Exception as err:
+            result = (None, err)
+
+        with self._lock:
+            if self._cancelled and result[0] is not None:
+                result[0].close()
+            else:
+                self._results.put(result)
+
+    def result(self):
+        response, error = self._results.get()
+        if error is not None:
+            raise error
+
+        return response
+
+    def cancel(self):
+        """Closes the response when it arrives, or now if it already has."""
+        with self._lock:
+            self._cancelled = True
+
+            while not self._results.empty():
+                response, _ = self._results.get()
+                if response is not None:
+                    response.close()
@@ -0,0 +1,442 @@
+"""Asyncio versions of the notrequests functions.
+
+    >>> response = await notrequests_aio.get('http://httpbin.org/get')
+    >>> response.status_code
+    200
+
+Requires Python 3.5 or later. The arguments are the same as for notrequests,
+and responses are notrequests.Response objects with the body already read.
+"""
+import asyncio
+import functools
+import io
+
+from six.moves import http_client
+from six.moves import urllib
+
+import notrequests
+
+
+_stream_errors = (asyncio.IncompleteReadError, asyncio.TimeoutError)
+_retryable_errors = (OSError, http_client.HTTPException) + _stream_errors
+
+
+class _Connection(object):
+    # Adapts an asyncio stream so it can be kept in a ConnectionPool.
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @property
+    def sock(self):
+        if self.reader.at_eof() or self.writer.transport.is_closing():
+            return None
+
+        return self.writer.get_extra_info('socket')
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncSession(object):
+    """Makes requests on the asyncio event loop, re-using connections.
+
+    Idle connections are kept in a ConnectionPool, with at most pool_maxsize
+    connections for each host. With pool_maxsize=0 every connection is closed
+    after one request.
+
+    If json_codec is given (a notrequests.JSONCodec or the name of one) it is
+    used to encode and decode JSON for every request. Likewise retries, a
+    notrequests.Retry or a number of retries, is used when a request fails,
+    hooks are called before the hooks for each request, and redirect_cache (a
+    notrequests.RedirectCache) remembers permanent redirects.
+
+    Cookies set by responses are kept in session.cookies, a
+    notrequests.CookieJar, and sent with later requests.
+    """
+
+    def __init__(self, pool_maxsize=10, pool_timeout=60, json_codec=None, retries=None,
+                 hooks=None, redirect_cache=None, cookies=None):
+        if pool_maxsize:
+            self.pool = notrequests.ConnectionPool(maxsize=pool_maxsize, idle_timeout=pool_timeout)
+        else:
+            self.pool = None
+
+        self.json_codec = json_codec
+        self.retries = retries
+        self.hooks = hooks
+        self.redirect_cache = redirect_cache
+        self.cookies = notrequests.CookieJar() if cookies is None else cookies
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes idle connections."""
+        if self.pool is not None:
+            self.pool.clear()
+
+    async def request(self, method, url, params=None, data=None, headers=None,
+                      cookies=None, auth=None, json=None, files=None,
+                      allow_redirects=True, verify=True, timeout=None,
+                      compress=None, compress_min_size=1024, json_lines=None,
+                      json_codec=None, retries=None, deadline=None, hooks=None,
+                      max_redirects=None, redirect_cache=None):
+        request = notrequests._build_request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=headers,
+            cookies=cookies,
+            auth=auth,
+            json=json,
+            files=files,
+            compress=compress,
+            compress_min_size=compress_min_size,
+            json_lines=json_lines,
+            json_codec=self.json_codec if json_codec is None else json_codec,
+        )
+        hooks = notrequests._merge_hooks(self.hooks, hooks)
+        request = notrequests._dispatch_hook('pre_request', hooks, request)
+        ssl_context = notrequests._ssl_context(verify)
+        retry = notrequests._retry_policy(self.retries if retries is None else retries)
+
+        if max_redirects is None:
+            max_redirects = notrequests._max_redirects
+
+        if not allow_redirects:
+            max_redirects = None
+        elif redirect_cache is None:
+            redirect_cache = self.redirect_cache
+
+        if max_redirects is not None and redirect_cache is not None:
+            request = redirect_cache._follow(request, max_redirects)
+
+        send = self._send_with_redirects(request, ssl_context, timeout, retry, max_redirects,
+                                         redirect_cache)
+
+        if deadline is None:
+            response = await send
+        else:
+            try:
+                response = await asyncio.wait_for(send, deadline)
+            except asyncio.TimeoutError as err:
+                if isinstance(err, notrequests.Timeout):
+                    raise
+                raise notrequests.DeadlineExceeded('Deadline exceeded for %s' % url)
+
+        return notrequests._dispatch_hook('response', hooks, response)
+
+    async def _send_with_redirects(self, request, ssl_context, timeout, retry, max_redirects,
+                                   redirect_cache):
+        # With max_redirects=None redirect responses are returned as they are.
+        url = request.get_full_url()
+        history = []
+
+        while True:
+            self.cookies.add_cookie_header(request)
+            response = await self._send_with_retries(request, ssl_context, timeout, retry)
+            self.cookies.extract_cookies(response.raw, request)
+            location = response.headers.get('Location')
+
+            if max_redirects is None or not location:
+                break
+            if response.status_code not in notrequests._redirect_codes:
+                break
+            if len(history) >= max_redirects:
+                raise notrequests.TooManyRedirects(
+                    'Exceeded %d redirects for %s' % (max_redirects, url))
+
+            history.append(response)
+            request = notrequests._redirect_request(request, response.status_code, location)
+
+            if redirect_cache is not None and response.status_code in notrequests._permanent_redirect_codes:
+                redirect_cache.put(response.url, response.status_code, location)
+
+        response.history = history
+
+        return response
+
+    async def delete(self, url, **kwargs):
+        return await self.request('DELETE', url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        return await self.request('HEAD', url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+
+    async def _send_with_retries(self, request, ssl_context, timeout, retry):
+        started = notrequests._clock()
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            try:
+                response = await self._send(request, ssl_context, timeout)
+            except _retryable_errors as err:
+                if retry is None or not (isinstance(err, _stream_errors) or notrequests._is_retryable_error(err)):
+                    raise
+
+                elapsed = notrequests._clock() - started
+                delay = retry._delay(request.get_method(), attempt, elapsed, error=err)
+                if delay is None or not notrequests._rewind_body(request):
+                    raise
+            else:
+                if retry is None:
+                    return response
+
+                elapsed = notrequests._clock() - started
+                delay = retry._delay(request.get_method(), attempt, elapsed, response=response)
+                if delay is None or not notrequests._rewind_body(request):
+                    return response
+
+            await asyncio.sleep(delay)
+
+    async def _send(self, request, ssl_context, timeout):
+        parts = urllib.parse.urlsplit(request.get_full_url())
+        scheme = parts.scheme
+        if scheme not in notrequests._default_ports:
+            raise urllib.error.URLError('unknown url type: %s' % scheme)
+
+        host = parts.hostname
+        port = parts.port or notrequests._default_ports[scheme]
+        context = ssl_context if scheme == 'https' else None
+        key = (scheme, host, port, None, context)
+        connect_timeout, read_timeout = notrequests._split_timeout(timeout)
+
+        conn = None if self.pool is None else self.pool.get(key)
+        if conn is not None:
+            try:
+                return await self._exchange(conn, key, request, read_timeout)
+            except (http_client.HTTPException, asyncio.IncompleteReadError, ConnectionError):
+                # The server closed the idle connection. Try again on a new
+                # connection if the body can be re-sent.
+                if not (request.data is None or isinstance(request.data, bytes)):
+                    raise
+
+        started = notrequests._clock()
+
+        try:
+            connect = asyncio.open_connection(
+                host,
+                port,
+                ssl=context,
+                server_hostname=host if context else None,
+            )
+            reader, writer = await _wait(connect, connect_timeout, notrequests.ConnectTimeout)
+        except notrequests.Timeout:
+            raise
+        except OSError as err:
+            raise urllib.error.URLError(err)
+
+        connected = notrequests._clock() - started
+
+        return await self._exchange(_Connection(reader, writer), key, request, read_timeout, connected)
+
+    async def _exchange(self, conn, key, request, timeout, connected=None):
+        method = request.get_method()
+        timings = notrequests.Timings()
+        if connected is not None:
+            # Includes looking up the host and the TLS handshake.
+            timings.connect = connected
+            timings.reused_connection = False
+
+        try:
+            started = notrequests._clock()
+            timings.bytes_sent = await _write_request(conn.writer, request, keep_alive=self.pool is not None)
+            version, status, reason, headers = await _read_head(conn.reader, timeout)
+            timings.ttfb = notrequests._clock() - started
+
+            started = notrequests._clock()
+            body, reusable = await _read_body(conn.reader, method, version, status, headers, timeout)
+            timings.download = notrequests._clock() - started
+            timings.bytes_received = len(body)
+        except BaseException:
+            conn.close()
+            raise
+
+        if reusable and self.pool is not None:
+            self.pool.put(key, conn)
+        else:
+            conn.close()
+
+        raw = notrequests._BufferedResponse(status, reason, headers, request.get_full_url(), body)
+        raw.timings = timings
+
+        return notrequests._build_response(raw, request)
+
+
+async def _wait(awaitable, timeout, timeout_class=notrequests.ReadTimeout):
+    if timeout is None:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise timeout_class('timed out')
+
+
+def _encode_header(value):
+    if isinstance(value, bytes):
+        return value
+
+    return str(value).encode(notrequests.LATIN1)
+
+
+async def _write_request(writer, request, keep_alive=True):
+    headers = {name.title(): value for name, value in request.header_items()}
+    headers.setdefault('Host', request.host)
+    headers.setdefault('Accept-Encoding', 'identity')
+    if not keep_alive:
+        headers['Connection'] = 'close'
+
+    method = request.get_method()
+    data = request.data
+    chunked = False
+
+    # The same defaults as urllib and http.client.
+    if data is not None:
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        if isinstance(data, bytes):
+            headers['Content-Length'] = str(len(data))
+        elif 'Content-Length' not in headers:
+            headers['Transfer-Encoding'] = 'chunked'
+            chunked = True
+    elif method in ('PATCH', 'POST', 'PUT'):
+        headers['Content-Length'] = '0'
+
+    lines = [('%s %s HTTP/1.1' % (method, request.selector)).encode('ascii')]
+    lines.extend(_encode_header(k) + b': ' + _encode_header(v) for k, v in headers.items())
+    head = b'\r\n'.join(lines) + b'\r\n\r\n'
+    writer.write(head)
+    sent = len(head)
+
+    if isinstance(data, bytes):
+        writer.write(data)
+        sent += len(data)
+    elif data is not None:
+        # Files are read in pieces (not lines), and the body is read in a
+        # thread so reading files doesn't block the event loop.
+        chunks = notrequests._iter_file(data) if hasattr(data, 'read') else iter(data)
+        loop = asyncio.get_event_loop()
+
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                # An empty chunk would end a chunked body.
+                continue
+
+            if chunked:
+                chunk = b'%X\r\n%s\r\n' % (len(chunk), chunk)
+            writer.write(chunk)
+            sent += len(chunk)
+            await writer.drain()
+
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            sent += 5
+
+    await writer.drain()
+
+    return sent
+
+
+async def _read_headers(reader, timeout):
+    lines = []
+    while True:
+        line = await _wait(reader.readline(), timeout)
+        lines.append(line)
+        if line in (b'\r\n', b'\n', b''):
+            break
+
+    return http_client.parse_headers(io.BytesIO(b''.join(lines)))
+
+
+async def _read_chunked(reader, timeout):
+    chunks = []
+    while True:
+        line = await _wait(reader.readline(), timeout)
+        size = int(line.split(b';', 1)[0], 16)
+        if not size:
+            # Discard any trailers.
+            await _read_headers(reader, timeout)
+            break
+
+        chunks.append(await _wait(reader.readexactly(size), timeout))
+        await _wait(reader.readexactly(2), timeout)
+
+    return b''.join(chunks)
+
+
+async def _read_head(reader, timeout):
+    """Reads the status line and headers of the final response."""
+    while True:
+        line = await _wait(reader.readline(), timeout)
+        if not line:
+            raise http_client.RemoteDisconnected('Remote end closed connection without response')
+
+        try:
+            version, status, reason = (line.decode(notrequests.LATIN1).rstrip('\r\n').split(None, 2) + [''])[:3]
+            status = int(status)
+        except ValueError:
+            raise http_client.BadStatusLine(line)
+
+        headers = await _read_headers(reader, timeout)
+
+        # Skip "100 Continue" and other informational responses.
+        if status >= 200 or status == 101:
+            return version, status, reason, headers
+
+
+async def _read_body(reader, method, version, status, headers, timeout):
+    """Reads the body, and whether the connection can be re-used."""
+    connection = headers.get('Connection', '').lower()
+    if version == 'HTTP/1.0':
+        will_close = 'keep-alive' not in connection
+    else:
+        will_close = 'close' in connection
+
+    if method == 'HEAD' or status in (204, 304) or status < 200:
+        body = b''
+    elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        body = await _read_chunked(reader, timeout)
+    elif headers.get('Content-Length'):
+        body = await _wait(reader.readexactly(int(headers['Content-Length'])), timeout)
+    else:
+        body = await _wait(reader.read(), timeout)
+        will_close = True
+
+    return body, not will_close
+
+
+async def request(method, url, **kwargs):
+    """Makes a request on a new connection, like notrequests.request()."""
+    async with AsyncSession(pool_maxsize=0) as session:
+        return await session.request(method, url, **kwargs)
+
+
+delete = functools.partial(request, 'DELETE')
+get = functools.partial(request, 'GET')
+head = functools.partial(request, 'HEAD')
+patch = functools.partial(request, 'PATCH')
+post = functools.partial(request, 'POST')
+put = functools.partial(request, 'PUT')
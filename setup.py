@@ -24,6 +24,6 @@ setup(
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
     ],
-    py_modules=['notrequests'],
+    py_modules=['notrequests', 'notrequests_aio'],
     install_requires=['six'],
 )
@@ -0,0 +1,5 @@
+import sys
+
+
+# The asyncio API needs async / await syntax.
+collect_ignore = [] if sys.version_info >= (3, 5) else ['test_notrequests_aio.py']
@@ -1,14 +1,26 @@
 #!/usr/bin/env python
+import datetime
 import io
 import json
 import os
 import socket
 import ssl
+import sys
 import tempfile
+import threading
+import time
 import unittest
 import warnings
+import zlib
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
 from six.moves import urllib
 
 import notrequests as nr
@@ -20,6 +32,39 @@ def _url(path):
     return urllib.parse.urljoin(base_url, path)
 
 
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _start_server(handler_class, ssl_context=None, **attrs):
+    """Serves handler_class on a free port in a background thread.
+
+    The attributes are set on the server for the handler to use. Stop the
+    server with _stop_server().
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    if ssl_context is not None:
+        server.socket = ssl_context.wrap_socket(server.socket, server_side=True)
+
+    for name, value in attrs.items():
+        setattr(server, name, value)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def _stop_server(server):
+    server.shutdown()
+    server.server_close()
+
+
+_needs_chunked = unittest.skipIf(sys.version_info < (3, 6), 'Chunked request bodies need Python 3.6 or later')
+_needs_iterator_body = unittest.skipIf(six.PY2, 'Python 2 cannot send a body from an iterator')
+
+
 class PackageAPITestCase(unittest.TestCase):
     def test_api(self):
         nr.get
@@ -30,6 +75,31 @@ class PackageAPITestCase(unittest.TestCase):
         nr.head
         nr.codes
         nr.HTTPError
+        nr.Session
+        nr.map
+        nr.imap_unordered
+        nr.MemoryCache
+        nr.SQLiteCache
+        nr.JSONCodec
+        nr.register_json_codec
+        nr.get_json_codec
+        nr.Retry
+        nr.Hedge
+        nr.Timeout
+        nr.ConnectTimeout
+        nr.ReadTimeout
+        nr.DeadlineExceeded
+        nr.Timings
+        nr.register_hook
+        nr.unregister_hook
+        nr.DNSCache
+        nr.TLSSessionCache
+        nr.TooManyRedirects
+        nr.RedirectCache
+        nr.CookieJar
+        nr.paginate
+        nr.prepare
+        nr.RequestTemplate
 
 
 class GetTestCase(unittest.TestCase):
@@ -211,6 +281,54 @@ class PostTestCase(unittest.TestCase):
         self.assertEqual(data['data'], '{"foo": "bar"}')
         self.assertEqual(data['headers']['Content-Type'], 'application/json')
 
+    def test_json_keyword_with_json_codec(self):
+        url = _url('/post')
+        response = nr.post(url, json={'foo': 'bar'}, json_codec='json')
+
+        data = response.json()
+
+        self.assertEqual(data['data'], '{"foo": "bar"}')
+
+    @_needs_chunked
+    def test_sending_data_from_generator(self):
+        url = _url('/post')
+        chunks = (value for value in [b'foo', u'bar'])
+        response = nr.post(url, data=chunks, headers={'Content-Type': 'text/plain'})
+
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+
+        self.assertEqual(data['headers']['Transfer-Encoding'], 'chunked')
+        self.assertEqual(data['data'], 'foobar')
+
+    @unittest.skipUnless(sys.version_info < (3, 6), 'Chunked request bodies work on Python 3.6 or later')
+    def test_chunked_body_on_old_python(self):
+        with self.assertRaises(ValueError):
+            nr.post(_url('/post'), data=iter([b'foo']))
+
+    def test_sending_data_from_file(self):
+        url = _url('/post')
+        response = nr.post(url, data=io.BytesIO(b'foobar'), headers={'Content-Type': 'text/plain'})
+
+        data = response.json()
+
+        self.assertEqual(data['headers']['Content-Length'], '6')
+        self.assertEqual(data['data'], 'foobar')
+
+    @_needs_chunked
+    def test_json_lines_keyword(self):
+        url = _url('/post')
+        values = ({'n': n} for n in range(3))
+        response = nr.post(url, json_lines=values)
+
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+
+        self.assertEqual(data['headers']['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in data['data'].splitlines()], [{'n': 0}, {'n': 1}, {'n': 2}])
+
     def test_submit_file_with_file_object(self):
         url = _url('/post')
         files = {'file': io.BytesIO(b'binarydata')}
@@ -280,6 +398,110 @@ class PostTestCase(unittest.TestCase):
         self.assertEqual(data['form'], {'foo': 'bar baz'})
 
 
+    @_needs_chunked
+    def test_submit_file_without_size(self):
+        # The file can't seek, so the body is sent with chunked encoding.
+        url = _url('/post')
+        files = {'file': UnseekableFile(b'binarydata')}
+        response = nr.post(url, files=files)
+
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+
+        self.assertEqual(data['files'], {'file': 'binarydata'})
+        self.assertEqual(data['headers']['Transfer-Encoding'], 'chunked')
+
+
+class UnseekableFile(object):
+    def __init__(self, value):
+        self._fh = io.BytesIO(value)
+
+    def read(self, size=-1):
+        return self._fh.read(size)
+
+
+class BuildFormDataTestCase(unittest.TestCase):
+    def test_files_are_read_when_body_is_sent(self):
+        fileobj = io.BytesIO(b'binarydata')
+        content_type, body = nr._build_form_data({'foo': b'bar'}, {'file': fileobj})
+
+        self.assertIsInstance(body, nr.MultipartBody)
+        self.assertEqual(fileobj.tell(), 0)
+
+        value = b''.join(body)
+
+        self.assertEqual(len(value), body.length)
+        self.assertIn(b'\r\n\r\nbinarydata\r\n--', value)
+
+    def test_byte_strings_are_joined(self):
+        files = {'file': ('foo.txt', b'binarydata')}
+        content_type, body = nr._build_form_data(None, files)
+
+        self.assertIsInstance(body, six.binary_type)
+        self.assertTrue(body.endswith(b'--\r\n'))
+
+    def _send_and_receive(self, body, sock, peer):
+        # Enough for the test bodies, so send() won't block.
+        body.send(sock)
+        sock.close()
+
+        received = []
+        while True:
+            chunk = peer.recv(65536)
+            if not chunk:
+                break
+            received.append(chunk)
+        peer.close()
+
+        return b''.join(received)
+
+    @unittest.skipUnless(hasattr(socket.socket, 'sendfile'), 'socket.sendfile() needs Python 3.5 or later')
+    def test_send_file_from_disk(self):
+        fileobj = tempfile.NamedTemporaryFile()
+        self.addCleanup(fileobj.close)
+        fileobj.write(b'binarydata')
+        fileobj.seek(0)
+
+        content_type, body = nr._build_form_data(None, {'file': fileobj})
+        expected = b''.join(body)
+        fileobj.seek(0)
+
+        sock, peer = socket.socketpair()
+        sendfile = socket.socket.sendfile
+        with mock.patch.object(socket.socket, 'sendfile', autospec=True, side_effect=sendfile) as patched:
+            received = self._send_and_receive(body, sock, peer)
+
+        self.assertEqual(received, expected)
+        self.assertEqual(len(received), body.length)
+        self.assertEqual(patched.call_count, 1)
+        self.assertIs(patched.call_args[0][1], fileobj)
+
+    def test_send_without_sendfile(self):
+        class Socket(object):
+            def __init__(self, sock):
+                self._sock = sock
+                self.sendall = sock.sendall
+                self.close = sock.close
+
+        content_type, body = nr._build_form_data(None, {'file': io.BytesIO(b'binarydata')})
+        expected = b''.join(body)
+        content_type, body = nr._build_form_data(None, {'file': io.BytesIO(b'binarydata')})
+
+        sock, peer = socket.socketpair()
+        received = self._send_and_receive(body, Socket(sock), peer)
+
+        # The boundary is random, so compare around it.
+        self.assertEqual(len(received), len(expected))
+        self.assertIn(b'\r\n\r\nbinarydata\r\n--', received)
+
+    def test_length_is_none_without_file_size(self):
+        files = {'file': UnseekableFile(b'binarydata')}
+        content_type, body = nr._build_form_data(None, files)
+
+        self.assertIsNone(body.length)
+
+
 class PutTestCase(unittest.TestCase):
     def test_put(self):
         url = _url('/put')
@@ -359,6 +581,14 @@ class ResponseTestCase(unittest.TestCase):
         self.assertNotIn('Link', response.headers)
         self.assertEqual(response.links, {})
 
+    def test_links_from_several_link_headers(self):
+        url = _url('/response-headers')
+        params = [('Link', '</a>; rel="prev"'), ('Link', '</b>; rel="next"')]
+        response = nr.get(url, params=params)
+
+        self.assertEqual(response.links['prev']['url'], '/a')
+        self.assertEqual(response.links['next']['url'], '/b')
+
     def test_cookies_are_decoded_correctly(self):
         # Previously we caused cookielib errors trying to parse complex cookies.
         # http://www.adobe.com/support/downloads/product.jsp?product=1&platform=Windows
@@ -425,6 +655,1463 @@ class ResponseTestCase(unittest.TestCase):
         self.assertFalse(response.ok)
 
 
+class StreamTestCase(unittest.TestCase):
+    def test_content_is_read_when_used(self):
+        url = _url('/bytes/100')
+        response = nr.get(url, stream=True)
+
+        self.assertIsNone(response._content)
+        self.assertEqual(len(response.content), 100)
+
+    def test_iter_content(self):
+        url = _url('/bytes/1000')
+        response = nr.get(url, stream=True)
+        chunks = list(response.iter_content(300))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+
+    def test_iter_content_after_content_is_read(self):
+        url = _url('/bytes/10')
+        response = nr.get(url)
+        chunks = list(response.iter_content(4))
+
+        self.assertEqual(b''.join(chunks), response.content)
+        self.assertEqual(len(chunks), 3)
+
+    def test_content_after_iter_content_raises_error(self):
+        url = _url('/bytes/10')
+        response = nr.get(url, stream=True)
+        list(response.iter_content(4))
+
+        with self.assertRaises(RuntimeError):
+            response.content
+
+    def test_iter_lines(self):
+        url = _url('/stream/3')
+        response = nr.get(url, stream=True)
+        lines = list(response.iter_lines(chunk_size=10))
+
+        self.assertEqual([json.loads(line.decode('utf-8'))['id'] for line in lines], [0, 1, 2])
+
+    def test_iter_lines_across_chunks(self):
+        cases = [
+            (b'a,b,c', b',', [b'a', b'b', b'c']),
+            (b'a,,b,', b',', [b'a', b'', b'b']),
+            (b'a<>b<>c', b'<>', [b'a', b'b', b'c']),
+            (b'ab\r\ncd\r\nef', None, [b'ab', b'cd', b'ef']),
+            (b'ab\n\ncd\r\n', None, [b'ab', b'', b'cd']),
+            (b'ab\r\rcd\r', None, [b'ab', b'', b'cd']),
+        ]
+
+        for body, delimiter, expected in cases:
+            for chunk_size in range(1, len(body) + 1):
+                raw = nr._BufferedResponse(200, 'OK', nr._message_from_items([]), 'http://example.com/', body)
+                response = nr.Response(raw, nr.Request('GET', 'http://example.com/'), stream=True)
+                lines = list(response.iter_lines(chunk_size=chunk_size, delimiter=delimiter))
+
+                self.assertEqual(lines, expected, (body, chunk_size))
+
+    def test_iter_content_decode_unicode(self):
+        url = _url('/encoding/utf8')
+        response = nr.get(url, stream=True)
+        text = u''.join(response.iter_content(7, decode_unicode=True))
+
+        self.assertEqual(text[:21], u'<h1>Unicode Demo</h1>')
+
+    @unittest.skipIf(six.PY2, 'Connections are not pooled on Python 2')
+    def test_close(self):
+        url = _url('/stream/3')
+
+        with nr.Session() as session:
+            with session.get(url, stream=True) as response:
+                self.assertEqual(response.status_code, 200)
+
+            self.assertTrue(response.raw.closed)
+            self.assertEqual(len(session.pool), 0)
+
+
+class LazyResponseTestCase(unittest.TestCase):
+    def test_json_is_kept(self):
+        response = nr.get(_url('/get'))
+
+        self.assertIs(response.json(), response.json())
+        self.assertIsNot(response.json(parse_int=str), response.json())
+
+    def test_text_is_kept(self):
+        response = nr.get(_url('/encoding/utf8'))
+
+        self.assertIs(response.text, response.text)
+
+    def test_no_instance_dict(self):
+        response = nr.get(_url('/get'))
+
+        with self.assertRaises(AttributeError):
+            response.foo = 'bar'
+
+
+class StreamJSONTestCase(unittest.TestCase):
+    def test_iter_json_items(self):
+        url = _url('/json')
+        response = nr.get(url, stream=True)
+        slides = list(response.iter_json_items('slideshow.slides'))
+
+        self.assertEqual([slide['title'] for slide in slides], ['Wake up to WonderWidgets!', 'Overview'])
+
+    def test_iter_json_lines(self):
+        url = _url('/stream/4')
+        response = nr.get(url, stream=True)
+
+        self.assertEqual([value['id'] for value in response.iter_json_lines()], [0, 1, 2, 3])
+
+    def test_values_split_across_chunks(self):
+        text = u'{"a": {"b": [1, "]"]}, "items": [1, 22, {"b": [3]}, "x,]", 3.5e10, true, null]}'
+        expected = [1, 22, {'b': [3]}, 'x,]', 3.5e10, True, None]
+
+        for size in (1, 2, 3, 7, len(text)):
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            values = list(nr._JSONStream(chunks).iter_items(['items']))
+
+            self.assertEqual(values, expected)
+
+    def test_empty_array(self):
+        self.assertEqual(list(nr._JSONStream([u' [ ] ']).iter_items([])), [])
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            list(nr._JSONStream([u'{"a": []}']).iter_items(['b']))
+
+
+class DecompressionTestCase(unittest.TestCase):
+    def test_accept_encoding_header(self):
+        url = _url('/headers')
+        response = nr.get(url)
+
+        self.assertEqual(response.json()['headers']['Accept-Encoding'], 'gzip, deflate')
+
+    def test_gzip(self):
+        url = _url('/gzip')
+        response = nr.get(url)
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(response.json()['gzipped'])
+
+    def test_deflate(self):
+        url = _url('/deflate')
+        response = nr.get(url)
+
+        self.assertTrue(response.json()['deflated'])
+
+    def test_raw_deflate(self):
+        compressed = zlib.compress(b'binarydata')[2:-4]
+        chunks = nr._iter_decompress([compressed], 'deflate')
+
+        self.assertEqual(b''.join(chunks), b'binarydata')
+
+    def test_deflate_in_one_byte_chunks(self):
+        for compressed in (zlib.compress(b'binarydata'), zlib.compress(b'binarydata')[2:-4]):
+            chunks = nr._iter_decompress([compressed[n:n + 1] for n in range(len(compressed))], 'deflate')
+
+            self.assertEqual(b''.join(chunks), b'binarydata')
+
+    def test_iter_content_decompresses(self):
+        url = _url('/gzip')
+        response = nr.get(url, stream=True)
+        value = b''.join(response.iter_content(10))
+
+        self.assertTrue(json.loads(value.decode('utf-8'))['gzipped'])
+
+    def test_max_content_size(self):
+        url = _url('/gzip')
+
+        with self.assertRaises(nr.HTTPError):
+            nr.get(url, max_content_size=100)
+
+
+class CompressTestCase(unittest.TestCase):
+    def test_compress_json(self):
+        value = {'foo': ['bar'] * 1000}
+        request = nr._build_request('POST', 'http://example.com/', json=value, compress='gzip')
+        data = zlib.decompress(request.data, 16 + zlib.MAX_WBITS)
+
+        self.assertEqual(request.get_header('Content-encoding'), 'gzip')
+        self.assertEqual(json.loads(data.decode('utf-8')), value)
+
+    def test_small_body_is_not_compressed(self):
+        request = nr._build_request('POST', 'http://example.com/', data=b'foo', compress='gzip')
+
+        self.assertEqual(request.data, b'foo')
+        self.assertIsNone(request.get_header('Content-encoding'))
+
+    def test_compress_streamed_body(self):
+        files = {'file': UnseekableFile(b'binarydata')}
+        request = nr._build_request('POST', 'http://example.com/', files=files, compress='deflate')
+        data = zlib.decompress(b''.join(request.data))
+
+        self.assertIn(b'binarydata', data)
+        self.assertIsNone(request.get_header('Content-length'))
+
+    def test_compress_file_in_chunks(self):
+        body = b'x' * (3 * nr._chunk_size)
+        fileobj = io.BytesIO(body)
+        read_sizes = []
+        read = fileobj.read
+        fileobj.read = lambda size=-1: read_sizes.append(size) or read(size)
+
+        request = nr._build_request('POST', 'http://example.com/', data=fileobj, compress='gzip')
+        data = zlib.decompress(b''.join(request.data), 16 + zlib.MAX_WBITS)
+
+        self.assertEqual(data, body)
+        self.assertTrue(read_sizes)
+        self.assertTrue(all(0 < size <= nr._chunk_size for size in read_sizes))
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            nr._build_request('POST', 'http://example.com/', data=b'foo', compress='br')
+
+    def test_send_compressed_body(self):
+        url = _url('/post')
+        response = nr.post(url, data=b'x' * 2048, compress='gzip')
+        data = response.json()
+
+        self.assertEqual(data['headers']['Content-Encoding'], 'gzip')
+
+
+class UpperCaseCodec(nr.JSONCodec):
+    name = 'upper'
+
+    def loads(self, value, **kwargs):
+        return super(UpperCaseCodec, self).loads(value.upper(), **kwargs)
+
+
+class JSONCodecTestCase(unittest.TestCase):
+    def test_default_codec(self):
+        codec = nr.get_json_codec()
+
+        self.assertIsInstance(codec, nr.JSONCodec)
+        self.assertEqual(json.loads(codec.dumps({'foo': [1, 2]}).decode('utf-8')), {'foo': [1, 2]})
+        self.assertEqual(codec.loads(b'{"foo": [1, 2]}'), {'foo': [1, 2]})
+
+    def test_default_codec_is_json_module(self):
+        codec = nr.get_json_codec()
+
+        self.assertEqual(codec.name, 'json')
+        self.assertEqual(codec.loads(b'123456789012345678901234567890'), 123456789012345678901234567890)
+        self.assertEqual(codec.dumps({'a': float('nan')}), b'{"a": NaN}')
+
+    def test_get_codec_by_name(self):
+        self.assertEqual(nr.get_json_codec('json').name, 'json')
+
+        with self.assertRaises(ValueError):
+            nr.get_json_codec('nosuchcodec')
+
+    def test_codecs_accept_json_module_arguments(self):
+        for name in nr._json_codecs:
+            codec = nr.get_json_codec(name)
+
+            self.assertEqual(codec.dumps({'b': 1, 'a': 2}, sort_keys=True), b'{"a": 2, "b": 1}')
+            self.assertEqual(codec.loads(b'[1.5]', parse_float=str), ['1.5'])
+
+    def test_codecs_encode_integer_keys(self):
+        for name in nr._json_codecs:
+            codec = nr.get_json_codec(name)
+
+            self.assertEqual(json.loads(codec.dumps({1: 'a'}).decode('utf-8')), {'1': 'a'})
+
+    def test_codecs_decode_what_the_json_module_decodes(self):
+        for name in nr._json_codecs:
+            codec = nr.get_json_codec(name)
+            value = codec.loads(b'[NaN, Infinity]')
+
+            self.assertNotEqual(value[0], value[0])
+            self.assertEqual(value[1], float('inf'))
+
+            with self.assertRaises(ValueError):
+                codec.loads(b'[nonsense')
+
+    def test_response_json_with_codec(self):
+        url = _url('/get')
+        response = nr.get(url, json_codec=UpperCaseCodec())
+
+        self.assertIn('URL', response.json())
+
+    def test_session_json_codec(self):
+        nr.register_json_codec(UpperCaseCodec())
+        self.addCleanup(nr._json_codecs.pop, 'upper')
+
+        with nr.Session(json_codec='upper') as session:
+            response = session.get(_url('/get'))
+
+        self.assertIn('URL', response.json())
+
+
+class FlakyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Responds with 503 until the server has failed server.failures times.
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        self.server.bodies.append(body)
+
+        if len(self.server.bodies) <= self.server.failures:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            body = b''
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RetryTestCase(unittest.TestCase):
+    def start_server(self, failures):
+        server = _start_server(FlakyHandler, failures=failures, bodies=[])
+        self.addCleanup(_stop_server, server)
+
+        return server, 'http://127.0.0.1:%d/' % server.server_address[1]
+
+    def test_retries_bad_status(self):
+        server, url = self.start_server(failures=2)
+        response = nr.get(url, retries=nr.Retry(total=3, backoff_factor=0))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(server.bodies), 3)
+
+    def test_returns_last_response_when_retries_run_out(self):
+        server, url = self.start_server(failures=5)
+        response = nr.get(url, retries=1)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.bodies), 2)
+
+    def test_no_retries_by_default(self):
+        server, url = self.start_server(failures=1)
+        response = nr.get(url)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.bodies), 1)
+
+    def test_post_is_not_retried(self):
+        server, url = self.start_server(failures=1)
+        response = nr.post(url, data=b'foo', retries=3)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.bodies), 1)
+
+    def test_file_body_is_sent_again(self):
+        server, url = self.start_server(failures=1)
+        retry = nr.Retry(total=1, allowed_methods=['POST'])
+        fileobj = io.BytesIO(b'xxfoobar')
+        fileobj.seek(2)
+        response = nr.post(url, data=fileobj, retries=retry)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.bodies, [b'foobar', b'foobar'])
+
+    def test_multipart_body_is_sent_again(self):
+        server, url = self.start_server(failures=1)
+        retry = nr.Retry(total=1, allowed_methods=['POST'])
+        files = {'file': io.BytesIO(b'binarydata')}
+        response = nr.post(url, files=files, retries=retry)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.bodies[0], server.bodies[1])
+        self.assertIn(b'binarydata', server.bodies[1])
+
+    @_needs_iterator_body
+    def test_generator_body_is_not_sent_again(self):
+        server, url = self.start_server(failures=1)
+        retry = nr.Retry(total=1, allowed_methods=['POST'])
+        response = nr.post(url, data=iter([b'foo']), headers={'Content-Length': '3'}, retries=retry)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(server.bodies), 1)
+
+    def test_connection_error_is_retried(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        sock.close()
+
+        retry = nr.Retry(total=2, backoff_factor=0)
+        with self.assertRaises(urllib.error.URLError):
+            nr.post(url, data=b'foo', retries=retry)
+
+    def test_backoff(self):
+        retry = nr.Retry(backoff_factor=1, backoff_max=3, jitter=False)
+        delays = [retry._delay('GET', n, 0, error=socket.error()) for n in range(1, 4)]
+
+        self.assertEqual(delays, [1, 2, 3])
+
+    def test_jitter(self):
+        retry = nr.Retry(backoff_factor=1)
+
+        for _ in range(20):
+            self.assertTrue(0 <= retry._delay('GET', 3, 0, error=socket.error()) <= 4)
+
+    def test_max_time(self):
+        retry = nr.Retry(backoff_factor=1, jitter=False, max_time=10)
+
+        self.assertEqual(retry._delay('GET', 1, 8, error=socket.error()), 1)
+        self.assertIsNone(retry._delay('GET', 2, 9, error=socket.error()))
+
+    def test_retry_after(self):
+        self.assertEqual(nr._parse_retry_after('120'), 120)
+        self.assertEqual(nr._parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertIsNone(nr._parse_retry_after('soon'))
+
+    def test_errors_which_are_not_retried(self):
+        self.assertFalse(nr._is_retryable_error(urllib.error.URLError('unknown url type: ftp')))
+        self.assertFalse(nr._is_retryable_error(nr.HTTPError('Too big')))
+        self.assertTrue(nr._is_retryable_error(urllib.error.URLError(socket.error(111, 'Refused'))))
+
+
+class SlowHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Waits for the next of server.delays before responding.
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.respond()
+
+    def respond(self):
+        with self.server.lock:
+            number = len(self.server.requests)
+            delay = self.server.delays[number] if number < len(self.server.delays) else 0
+            self.server.requests.append(number)
+
+        time.sleep(delay)
+        body = str(number).encode('ascii')
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HedgeTestCase(unittest.TestCase):
+    def start_server(self, delays):
+        server = _start_server(SlowHandler, delays=delays, requests=[], lock=threading.Lock())
+        self.addCleanup(_stop_server, server)
+
+        return server, 'http://127.0.0.1:%d/' % server.server_address[1]
+
+    def test_slow_request_is_hedged(self):
+        server, url = self.start_server(delays=[2, 0])
+        started = time.time()
+        response = nr.get(url, hedge=0.1)
+
+        self.assertEqual(response.content, b'1')
+        self.assertLess(time.time() - started, 1.5)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_fast_request_is_not_hedged(self):
+        server, url = self.start_server(delays=[0])
+        response = nr.get(url, hedge=1)
+
+        self.assertEqual(response.content, b'0')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_post_is_not_hedged(self):
+        server, url = self.start_server(delays=[0.3])
+        response = nr.post(url, data=b'foo', hedge=0.01)
+
+        self.assertEqual(response.content, b'0')
+        self.assertEqual(len(server.requests), 1)
+
+    def test_error_if_every_copy_fails(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%d/' % sock.getsockname()[1]
+        sock.close()
+
+        with self.assertRaises(urllib.error.URLError):
+            nr.get(url, hedge=0)
+
+    def test_learned_delay(self):
+        hedge = nr.Hedge(min_samples=10)
+
+        for n in range(1, 10):
+            hedge._record(n / 100.0)
+
+        self.assertIsNone(hedge._delay())
+
+        hedge._record(0.1)
+
+        self.assertEqual(hedge._delay(), 0.1)
+
+        for _ in range(90):
+            hedge._record(0.01)
+
+        self.assertEqual(hedge._delay(), 0.05)
+
+
+class DripHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Waits server.wait seconds, then sends the body one byte at a time.
+
+    def do_GET(self):
+        time.sleep(self.server.wait)
+
+        self.send_response(200)
+        self.send_header('Content-Length', '100')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        try:
+            for _ in range(100):
+                self.wfile.write(b'x')
+                self.wfile.flush()
+                time.sleep(self.server.drip)
+        except socket.error:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TimeoutTestCase(unittest.TestCase):
+    def start_server(self, wait=0, drip=0):
+        server = _start_server(DripHandler, wait=wait, drip=drip)
+        self.addCleanup(_stop_server, server)
+
+        return 'http://127.0.0.1:%d/' % server.server_address[1]
+
+    def test_read_timeout(self):
+        url = self.start_server(wait=1)
+
+        with self.assertRaises(nr.ReadTimeout):
+            nr.get(url, timeout=(1, 0.1))
+
+    def test_read_timeout_is_socket_timeout(self):
+        url = self.start_server(wait=1)
+
+        with self.assertRaises(socket.timeout):
+            nr.get(url, timeout=(1, 0.1))
+
+    def test_deadline_for_slow_body(self):
+        url = self.start_server(drip=0.05)
+        started = time.time()
+
+        with self.assertRaises(nr.DeadlineExceeded):
+            nr.get(url, timeout=1, deadline=0.5)
+
+        self.assertLess(time.time() - started, 1.5)
+
+    def test_deadline_for_streamed_body(self):
+        url = self.start_server(drip=0.05)
+        response = nr.get(url, deadline=0.5, stream=True)
+
+        with self.assertRaises(nr.DeadlineExceeded):
+            for _ in response.iter_content(10):
+                pass
+
+    def test_deadline_includes_retries(self):
+        url = self.start_server(wait=0.3)
+        retry = nr.Retry(total=10, backoff_factor=0)
+        started = time.time()
+
+        with self.assertRaises(nr.Timeout):
+            nr.get(url, timeout=0.1, deadline=0.5, retries=retry)
+
+        self.assertLess(time.time() - started, 1.5)
+
+    def test_deadline_is_not_reached(self):
+        url = self.start_server()
+        response = nr.get(url, timeout=(1, 1), deadline=5)
+
+        self.assertEqual(response.content, b'x' * 100)
+
+    def test_connect_timeout(self):
+        timeouts = nr._Timeouts((0.1, 1))
+        error = nr._timeout_error(timeouts, socket.timeout('timed out'), nr.ConnectTimeout)
+
+        self.assertIsInstance(error, nr.ConnectTimeout)
+        self.assertTrue(nr._is_connect_error(error))
+
+    def test_connect_timeout_is_shortened_by_deadline(self):
+        timeouts = nr._Timeouts((10, 10), deadline=1)
+
+        self.assertLessEqual(timeouts.connect_timeout(), 1)
+
+        timeouts.expires = 0
+
+        with self.assertRaises(nr.DeadlineExceeded):
+            timeouts.connect_timeout()
+
+
+class TimingsTestCase(unittest.TestCase):
+    def test_timings(self):
+        url = _url('/bytes/1000')
+        response = nr.get(url)
+        timings = response.timings
+
+        self.assertFalse(timings.reused_connection)
+        self.assertIsNotNone(timings.dns)
+        self.assertIsNotNone(timings.connect)
+        self.assertIsNone(timings.tls)
+        self.assertGreater(timings.ttfb, 0)
+        self.assertIsNotNone(timings.download)
+        self.assertEqual(timings.bytes_received, 1000)
+        self.assertGreater(timings.bytes_sent, 0)
+        self.assertGreaterEqual(timings.total, timings.elapsed)
+
+    def test_elapsed(self):
+        url = _url('/get')
+        response = nr.get(url)
+
+        self.assertIsInstance(response.elapsed, datetime.timedelta)
+        self.assertAlmostEqual(response.elapsed.total_seconds(), response.timings.elapsed, places=5)
+
+    def test_bytes_sent(self):
+        url = _url('/post')
+        response = nr.post(url, data=b'x' * 5000)
+
+        self.assertGreater(response.timings.bytes_sent, 5000)
+
+    def test_download_is_none_until_body_is_read(self):
+        url = _url('/bytes/1000')
+        response = nr.get(url, stream=True)
+
+        self.assertIsNone(response.timings.download)
+
+        response.content
+
+        self.assertIsNotNone(response.timings.download)
+
+    def test_reused_connection(self):
+        with nr.Session() as session:
+            session.get(_url('/get'))
+            response = session.get(_url('/get'))
+
+        if response.timings.reused_connection:
+            self.assertIsNone(response.timings.connect)
+
+
+class HooksTestCase(unittest.TestCase):
+    def test_hooks(self):
+        calls = []
+        hooks = {
+            'pre_request': lambda request: calls.append(request.get_method()),
+            'response': [lambda response: calls.append(response.status_code)],
+        }
+        nr.get(_url('/get'), hooks=hooks)
+
+        self.assertEqual(calls, ['GET', 200])
+
+    def test_hook_can_replace_response(self):
+        response = nr.get(_url('/get'), hooks={'response': lambda response: 'replaced'})
+
+        self.assertEqual(response, 'replaced')
+
+    def test_pre_request_hook_can_change_request(self):
+        def add_header(request):
+            request.add_header('X-Hooked', 'yes')
+
+        response = nr.get(_url('/headers'), hooks={'pre_request': add_header})
+
+        self.assertEqual(response.json()['headers']['X-Hooked'], 'yes')
+
+    def test_registered_hooks_are_called_first(self):
+        calls = []
+        hook = lambda response: calls.append('global')
+        nr.register_hook('response', hook)
+        self.addCleanup(nr.unregister_hook, 'response', hook)
+
+        with nr.Session(hooks={'response': lambda response: calls.append('session')}) as session:
+            session.get(_url('/get'), hooks={'response': lambda response: calls.append('request')})
+
+        self.assertEqual(calls, ['global', 'session', 'request'])
+
+    def test_unknown_event(self):
+        with self.assertRaises(ValueError):
+            nr.register_hook('after_lunch', lambda response: None)
+
+        with self.assertRaises(ValueError):
+            nr.get(_url('/get'), hooks={'after_lunch': lambda response: None})
+
+
+def _addrinfo(ip, port, family=socket.AF_INET):
+    return (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (ip, port))
+
+
+class StubResolver(object):
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def __call__(self, host, port):
+        self.calls.append((host, port))
+        result = self.results[host]
+        if isinstance(result, Exception):
+            raise result
+        return [_addrinfo(ip, port) for ip in result]
+
+
+class DNSCacheTestCase(unittest.TestCase):
+    def test_addresses_are_cached(self):
+        resolver = StubResolver({'example.com': ['192.0.2.1']})
+        cache = nr.DNSCache(resolver=resolver)
+
+        cache.resolve('example.com', 80)
+        addresses = cache.resolve('example.com', 80)
+
+        self.assertEqual(addresses, [_addrinfo('192.0.2.1', 80)])
+        self.assertEqual(resolver.calls, [('example.com', 80)])
+
+    def test_addresses_expire(self):
+        resolver = StubResolver({'example.com': ['192.0.2.1']})
+        cache = nr.DNSCache(ttl=0, resolver=resolver)
+
+        cache.resolve('example.com', 80)
+        cache.resolve('example.com', 80)
+
+        self.assertEqual(len(resolver.calls), 2)
+
+    def test_failures_are_cached(self):
+        resolver = StubResolver({'example.invalid': socket.gaierror(socket.EAI_NONAME, 'Not found')})
+        cache = nr.DNSCache(resolver=resolver)
+
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                cache.resolve('example.invalid', 80)
+
+        self.assertEqual(len(resolver.calls), 1)
+
+    def test_round_robin(self):
+        resolver = StubResolver({'example.com': ['192.0.2.1', '192.0.2.2', '192.0.2.3']})
+        cache = nr.DNSCache(resolver=resolver)
+        first = [cache.resolve('example.com', 80)[0][4][0] for _ in range(4)]
+
+        self.assertEqual(first, ['192.0.2.1', '192.0.2.2', '192.0.2.3', '192.0.2.1'])
+
+    def test_max_entries(self):
+        resolver = StubResolver({'a.example': ['192.0.2.1'], 'b.example': ['192.0.2.2']})
+        cache = nr.DNSCache(max_entries=1, resolver=resolver)
+        cache.resolve('a.example', 80)
+        cache.resolve('b.example', 80)
+
+        self.assertEqual(len(cache), 1)
+
+    def test_interleave_families(self):
+        addresses = [
+            _addrinfo('::1', 80, socket.AF_INET6),
+            _addrinfo('::2', 80, socket.AF_INET6),
+            _addrinfo('192.0.2.1', 80),
+        ]
+        result = [address[4][0] for address in nr._interleave_families(addresses)]
+
+        self.assertEqual(result, ['::1', '192.0.2.1', '::2'])
+
+    def test_happy_eyeballs_falls_back(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+
+        addresses = [
+            _addrinfo('127.0.0.1', closed_port),
+            _addrinfo('192.0.2.1', 9),
+            _addrinfo('127.0.0.1', server.getsockname()[1]),
+        ]
+        started = time.time()
+        sock = nr._happy_eyeballs(addresses, 5, None, 0.1)
+        sock.close()
+
+        self.assertLess(time.time() - started, 1)
+
+    def test_happy_eyeballs_error_if_nothing_connects(self):
+        # The address is unreachable, or the connection times out.
+        with self.assertRaises(socket.error):
+            nr._happy_eyeballs([_addrinfo('192.0.2.1', 9)], 0.2, None, 0.1)
+
+    def test_request_with_dns_cache(self):
+        parts = urllib.parse.urlsplit(_url('/get'))
+        ip = socket.gethostbyname(parts.hostname)
+        resolver = StubResolver({'notrequests.invalid': [ip]})
+        cache = nr.DNSCache(resolver=resolver)
+        url = parts._replace(netloc='notrequests.invalid:%d' % (parts.port or 80)).geturl()
+
+        with nr.Session(dns_cache=cache) as session:
+            response = session.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(resolver.calls, [('notrequests.invalid', parts.port or 80)])
+
+
+CERTFILE = os.path.join(os.path.dirname(__file__), 'localhost.pem')
+
+
+@unittest.skipUnless(hasattr(ssl, 'SSLSession'), 'TLS sessions need Python 3.6 or later')
+class TLSSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(CERTFILE)
+
+        server = _start_server(
+            SlowHandler,
+            ssl_context=server_context,
+            delays=[],
+            requests=[],
+            lock=threading.Lock(),
+        )
+        self.addCleanup(_stop_server, server)
+
+        self.url = 'https://localhost:%d/' % server.server_address[1]
+        self.context = ssl.create_default_context(cafile=CERTFILE)
+
+    def test_session_is_resumed(self):
+        first = nr.get(self.url, verify=self.context)
+        second = nr.get(self.url, verify=self.context)
+
+        self.assertFalse(first.timings.tls_resumed)
+        self.assertTrue(second.timings.tls_resumed)
+        self.assertIsNotNone(second.timings.tls)
+
+    def test_sessions_are_kept_for_each_context(self):
+        nr.get(self.url, verify=self.context)
+        other_context = ssl.create_default_context(cafile=CERTFILE)
+        response = nr.get(self.url, verify=other_context)
+
+        self.assertFalse(response.timings.tls_resumed)
+
+    def test_plain_http(self):
+        response = nr.get(_url('/get'))
+
+        self.assertIsNone(response.timings.tls_resumed)
+
+    def test_session_cache_size(self):
+        cache = nr.TLSSessionCache(maxsize=2)
+        for n in range(3):
+            cache.put(n, object())
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0))
+
+
+class RedirectHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Redirects /<status>/<path> to /<path> (or to <path> if it is a URL),
+    # otherwise echoes the request.
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        self.server.requests.append((self.command, self.path, body, self.headers.get('Authorization')))
+
+        status, _, path = self.path.lstrip('/').partition('/')
+        if status.isdigit():
+            self.send_response(int(status))
+            self.send_header('Location', path if '://' in path else '/' + path)
+            body = b''
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RedirectTestCase(unittest.TestCase):
+    def setUp(self):
+        server = _start_server(RedirectHandler, requests=[])
+        self.addCleanup(_stop_server, server)
+
+        self.server = server
+        self.url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def test_history(self):
+        response = nr.get(self.url + '/302/301/end')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.url, self.url + '/end')
+        self.assertEqual([r.status_code for r in response.history], [302, 301])
+        self.assertEqual(response.history[0].url, self.url + '/302/301/end')
+
+    def test_allow_redirects_false(self):
+        response = nr.get(self.url + '/302/end', allow_redirects=False)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.history, [])
+
+    def test_too_many_redirects(self):
+        with self.assertRaises(nr.TooManyRedirects):
+            nr.get(self.url + '/302/302/302/end', max_redirects=2)
+
+        response = nr.get(self.url + '/302/302/end', max_redirects=2)
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_becomes_get(self):
+        for status in ('301', '302', '303'):
+            response = nr.post(self.url + '/%s/end' % status, data=b'foo')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.server.requests[-1][:3], ('GET', '/end', b''))
+
+    def test_post_is_kept(self):
+        for status in ('307', '308'):
+            fileobj = io.BytesIO(b'foo')
+            response = nr.post(self.url + '/%s/end' % status, data=fileobj)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.server.requests[-1][:3], ('POST', '/end', b'foo'))
+
+    @_needs_iterator_body
+    def test_generator_body_cannot_be_redirected(self):
+        with self.assertRaises(nr.HTTPError):
+            nr.post(self.url + '/307/end', data=iter([b'foo']), headers={'Content-Length': '3'})
+
+    def test_authorization_is_dropped_for_other_hosts(self):
+        other = self.url.replace('127.0.0.1', 'localhost')
+        nr.get(self.url + '/302/end', auth=('user', 'pass'))
+        nr.get(self.url + '/302/' + other + '/end', auth=('user', 'pass'))
+
+        self.assertIsNotNone(self.server.requests[1][3])
+        self.assertIsNone(self.server.requests[3][3])
+
+    def test_redirect_to_other_scheme_is_refused(self):
+        with self.assertRaises(nr.HTTPError):
+            nr.get(self.url + '/302/ftp://127.0.0.1/end')
+
+    def test_permanent_redirects_are_cached(self):
+        cache = nr.RedirectCache()
+
+        with nr.Session(redirect_cache=cache) as session:
+            session.get(self.url + '/301/302/end')
+            response = session.get(self.url + '/301/302/end')
+
+        paths = [path for _, path, _, _ in self.server.requests]
+        self.assertEqual(paths, ['/301/302/end', '/302/end', '/end', '/302/end', '/end'])
+        self.assertEqual(response.url, self.url + '/end')
+        self.assertEqual(len(cache), 1)
+
+    def test_redirect_cache_size(self):
+        cache = nr.RedirectCache(maxsize=2)
+        for n in range(3):
+            cache.put(str(n), 301, '/')
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('0'))
+
+
+class ParseLinksTestCase(unittest.TestCase):
+    def test_quoted_parameters(self):
+        links = nr._parse_links('<https://example.com/a,b>; rel="next"; title="a, b; c=\\"d\\""')
+
+        self.assertEqual(
+            links,
+            {'next': {'url': 'https://example.com/a,b', 'rel': 'next', 'title': 'a, b; c="d"'}},
+        )
+
+    def test_several_relation_types(self):
+        links = nr._parse_links('</a>; rel="next last", </b>; REL=prev; rel=first')
+
+        self.assertEqual(links['next'], links['last'])
+        self.assertEqual(links['prev'], {'url': '/b', 'rel': 'prev'})
+        self.assertNotIn('first', links)
+
+    def test_relation_types_are_case_insensitive(self):
+        links = nr._parse_links('</a>; rel="Next LAST"')
+
+        self.assertEqual(links['next'], {'url': '/a', 'rel': 'Next LAST'})
+        self.assertEqual(links['last'], links['next'])
+
+    def test_link_without_rel(self):
+        self.assertEqual(nr._parse_links('</a>'), {'/a': {'url': '/a'}})
+
+    def test_not_a_link(self):
+        self.assertEqual(nr._parse_links('nonsense'), {})
+
+
+class PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves /1 to /<server.pages>, each with a link to the next.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        page = int(self.path.lstrip('/').partition('?')[0])
+        body = str(page).encode('ascii')
+
+        self.send_response(200)
+        if page < self.server.pages:
+            self.send_header('Link', '</%d>; rel="%s", </1>; rel="first"' % (page + 1, self.server.rel))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PaginateTestCase(unittest.TestCase):
+    def setUp(self):
+        server = _start_server(PageHandler, pages=4, paths=[], rel='next')
+        self.addCleanup(_stop_server, server)
+
+        self.server = server
+        self.url = 'http://127.0.0.1:%d/1' % server.server_address[1]
+
+    def test_follows_next_links(self):
+        pages = [response.content for response in nr.paginate(self.url, params={'q': 'x'})]
+
+        self.assertEqual(pages, [b'1', b'2', b'3', b'4'])
+        self.assertEqual(self.server.paths, ['/1?q=x', '/2', '/3', '/4'])
+
+    def test_next_link_in_any_case(self):
+        self.server.rel = 'Next'
+        pages = [response.content for response in nr.paginate(self.url)]
+
+        self.assertEqual(pages, [b'1', b'2', b'3', b'4'])
+
+    def test_prefetch(self):
+        pages = [response.content for response in nr.paginate(self.url, prefetch=True)]
+
+        self.assertEqual(pages, [b'1', b'2', b'3', b'4'])
+
+    def test_prefetch_fetches_next_page_early(self):
+        pages = nr.paginate(self.url, prefetch=True)
+        next(pages)
+
+        for _ in range(50):
+            if len(self.server.paths) == 2:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.server.paths, ['/1', '/2'])
+        pages.close()
+
+    def test_max_pages(self):
+        pages = [response.content for response in nr.paginate(self.url, max_pages=2)]
+
+        self.assertEqual(pages, [b'1', b'2'])
+        self.assertEqual(len(self.server.paths), 2)
+
+    @unittest.skipIf(six.PY2, 'Connections are not pooled on Python 2')
+    def test_with_session(self):
+        with nr.Session() as session:
+            pages = list(nr.paginate(self.url, session=session))
+
+            self.assertEqual(len(pages), 4)
+            self.assertEqual(len(session.pool), 1)
+
+
+class PrepareTestCase(unittest.TestCase):
+    def test_same_as_build_request(self):
+        kwargs = {'headers': {'X-Foo': 'bar'}, 'auth': ('user', 'pass'), 'cookies': {'a': 'b'}}
+        url = 'http://example.com/path?x=1&x=2#frag'
+        template = nr.prepare('POST', url, **kwargs)
+
+        for params, data in ((None, None), ({'y': 'z z'}, b'body'), ([('w', '3')], {'k': 'v'})):
+            expected = nr._build_request('POST', url, params=params, data=data, **kwargs)
+            request = template.build(params, data=data)
+
+            self.assertEqual(request.get_full_url(), expected.get_full_url())
+            self.assertEqual(sorted(request.header_items()), sorted(expected.header_items()))
+            self.assertEqual(request.data, expected.data)
+
+    def test_params_replace_template_params(self):
+        template = nr.prepare('GET', 'http://example.com/?sort=name&page=1', params={'tag': ['a', 'b']})
+
+        request = template.build({'page': 2})
+        self.assertEqual(request.get_full_url(), 'http://example.com/?sort=name&page=2&tag=a&tag=b')
+
+        request = template.build([('tag', 'c'), ('q', 'x'), ('tag', 'd')])
+        self.assertEqual(request.get_full_url(), 'http://example.com/?sort=name&page=1&tag=c&tag=d&q=x')
+
+        response = nr.prepare('GET', _url('/get'), params={'page': 1})(params={'page': 2})
+        self.assertEqual(response.json()['args'], {'page': '2'})
+
+    def test_headers_for_one_request(self):
+        template = nr.prepare('GET', 'http://example.com/', headers={'X-Foo': 'bar'})
+        request = template.build(headers={'X-foo': 'baz'})
+
+        self.assertEqual(request.get_header('X-foo'), 'baz')
+        self.assertEqual(template.build().get_header('X-foo'), 'bar')
+
+    def test_call(self):
+        template = nr.prepare('POST', _url('/post'), params={'a': '1'}, headers={'X-Foo': 'bar'})
+        response = template(params={'b': '2'}, json={'n': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['args'], {'a': '1', 'b': '2'})
+        self.assertEqual(response.json()['json'], {'n': 1})
+        self.assertEqual(response.json()['headers']['X-Foo'], 'bar')
+
+    def test_body_defaults(self):
+        template = nr.prepare('POST', _url('/post'), json={'n': 1})
+
+        self.assertEqual(template().json()['json'], {'n': 1})
+        self.assertEqual(template(json={'n': 2}).json()['json'], {'n': 2})
+
+        template = nr.prepare('POST', _url('/post'), data=b'x', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(template().json()['data'], 'x')
+
+    def test_auth_and_cookies_for_one_request(self):
+        template = nr.prepare('GET', 'http://example.com/', auth=('a', 'b'), cookies={'c': 'd'})
+        request = template.build(auth=('user', 'pass'), cookies={'e': 'f'})
+
+        self.assertEqual(request.get_header('Authorization'), nr._encode_basic_auth('user', 'pass'))
+        self.assertEqual(request.unredirected_hdrs['Cookie'], 'e=f')
+        self.assertEqual(template.build().get_header('Authorization'), nr._encode_basic_auth('a', 'b'))
+
+    def test_unknown_arguments(self):
+        with self.assertRaises(TypeError):
+            nr.prepare('GET', 'http://example.com/', nonsense=1)
+
+        template = nr.prepare('GET', 'http://example.com/')
+        with self.assertRaises(TypeError):
+            template(nonsense=1)
+
+    def test_session_prepare(self):
+        with nr.Session() as session:
+            template = session.prepare('GET', _url('/get'))
+            for n in range(3):
+                response = template(params={'n': n})
+                self.assertEqual(response.json()['args'], {'n': str(n)})
+
+            self.assertLessEqual(len(session.pool), 1)
+
+
+class SessionTestCase(unittest.TestCase):
+    def test_get(self):
+        url = _url('/get')
+
+        with nr.Session() as session:
+            response = session.get(url, params={'foo': 'bar'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['args'], {'foo': 'bar'})
+
+    def test_repeated_requests(self):
+        url = _url('/post')
+
+        with nr.Session(pool_maxsize=1) as session:
+            for _ in range(3):
+                response = session.post(url, data={'foo': 'bar'})
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['form'], {'foo': 'bar'})
+
+            self.assertLessEqual(len(session.pool), 1)
+
+    def test_close_empties_pool(self):
+        session = nr.Session()
+        session.get(_url('/get'))
+        session.close()
+
+        self.assertEqual(len(session.pool), 0)
+
+
+class CookieJarTestCase(unittest.TestCase):
+    def test_session_keeps_cookies(self):
+        with nr.Session() as session:
+            response = session.get(_url('/cookies/set?foo=bar'))
+            self.assertEqual(response.json()['cookies'], {'foo': 'bar'})
+
+            response = session.get(_url('/cookies'))
+            self.assertEqual(response.json()['cookies'], {'foo': 'bar'})
+
+        self.assertEqual([cookie.name for cookie in session.cookies], ['foo'])
+
+    def test_request_cookies_win(self):
+        with nr.Session() as session:
+            session.get(_url('/cookies/set?foo=bar&spam=eggs'))
+            response = session.get(_url('/cookies'), cookies={'foo': 'baz'})
+
+        self.assertEqual(response.json()['cookies'], {'foo': 'baz', 'spam': 'eggs'})
+
+    def test_cookies_are_not_kept_without_session(self):
+        nr.get(_url('/cookies/set?foo=bar'))
+        response = nr.get(_url('/cookies'))
+
+        self.assertEqual(response.json()['cookies'], {})
+
+    def test_save_and_load(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+
+        with nr.Session() as session:
+            session.get(_url('/cookies/set?foo=bar'))
+            session.cookies.save(filename, ignore_discard=True)
+
+        jar = nr.CookieJar()
+        jar.load(filename, ignore_discard=True)
+
+        with nr.Session(cookies=jar) as session:
+            response = session.get(_url('/cookies'))
+
+        self.assertEqual(response.json()['cookies'], {'foo': 'bar'})
+
+    def test_cookie_domains(self):
+        request = nr.Request('GET', 'http://www.example.com/')
+        domains = nr._cookie_domains(request)
+
+        self.assertIn('www.example.com', domains)
+        self.assertIn('.example.com', domains)
+        self.assertNotIn('.example.org', domains)
+
+    def test_response_cookies_are_read_lazily(self):
+        response = nr.get(_url('/cookies/set?foo=bar'), allow_redirects=False)
+
+        self.assertIsNone(response._cookies)
+        self.assertEqual(response.cookies, {'foo': 'bar'})
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_map_returns_responses_in_order(self):
+        requests = [_url('/get?n=%d' % n) for n in range(10)]
+        responses = nr.map(requests, max_workers=4)
+
+        self.assertEqual([r.json()['args']['n'] for r in responses], [str(n) for n in range(10)])
+
+    def test_methods_and_arguments(self):
+        requests = [
+            ('POST', _url('/post'), {'json': {'foo': 'bar'}}),
+            ('DELETE', _url('/delete')),
+        ]
+        post_response, delete_response = nr.map(requests)
+
+        self.assertEqual(post_response.json()['json'], {'foo': 'bar'})
+        self.assertEqual(delete_response.status_code, 200)
+
+    def test_errors_are_returned(self):
+        requests = [_url('/get'), 'unknown://example.com/']
+        results = list(nr.imap_unordered(requests))
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len([r for r in results if isinstance(r, Exception)]), 1)
+
+    def test_stats(self):
+        stats = nr.BatchStats()
+        requests = [_url('/bytes/10')] * 5 + ['unknown://example.com/']
+        nr.map(requests, stats=stats)
+
+        self.assertEqual(stats.requests, 6)
+        self.assertEqual(stats.errors, 1)
+        self.assertEqual(stats.bytes, 50)
+        self.assertGreater(stats.requests_per_second, 0)
+
+    def test_per_host_limit(self):
+        requests = [_url('/delay/0.25')] * 4
+        stats = nr.BatchStats()
+        nr.map(requests, max_workers=4, per_host_limit=1, stats=stats)
+
+        self.assertGreaterEqual(stats.elapsed, 1.0)
+
+
+class CacheTestCase(unittest.TestCase):
+    def test_fresh_response_comes_from_cache(self):
+        url = _url('/cache/60')
+        cache = nr.MemoryCache()
+        response1 = nr.get(url, cache=cache)
+        response2 = nr.get(url, cache=cache)
+
+        self.assertFalse(response1.from_cache)
+        self.assertTrue(response2.from_cache)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(response2.content, response1.content)
+
+    def test_stale_response_is_revalidated(self):
+        url = _url('/etag/abc')
+        cache = nr.MemoryCache()
+        response1 = nr.get(url, cache=cache)
+        response2 = nr.get(url, cache=cache)
+
+        self.assertEqual(response2.request.get_header('If-none-match'), 'abc')
+        self.assertTrue(response2.from_cache)
+        self.assertEqual(response2.status_code, 200)
+        self.assertEqual(response2.content, response1.content)
+
+    def test_no_store_is_not_cached(self):
+        url = _url('/response-headers')
+        cache = nr.MemoryCache()
+        nr.get(url, params={'Cache-Control': 'no-store', 'ETag': 'abc'}, cache=cache)
+
+        self.assertEqual(len(cache), 0)
+
+    def test_post_is_not_cached(self):
+        url = _url('/post')
+        cache = nr.MemoryCache()
+        nr.post(url, cache=cache)
+
+        self.assertEqual(len(cache), 0)
+
+    def test_vary_header_must_match(self):
+        url = _url('/response-headers')
+        params = {'Cache-Control': 'max-age=60', 'Vary': 'X-Foo'}
+        cache = nr.MemoryCache()
+        nr.get(url, params=params, headers={'X-Foo': 'a'}, cache=cache)
+
+        response = nr.get(url, params=params, headers={'X-Foo': 'b'}, cache=cache)
+        self.assertFalse(response.from_cache)
+
+        response = nr.get(url, params=params, headers={'X-Foo': 'b'}, cache=cache)
+        self.assertTrue(response.from_cache)
+
+    def test_session_cache(self):
+        url = _url('/cache/60')
+
+        with nr.Session(cache=nr.MemoryCache()) as session:
+            session.get(url)
+            response = session.get(url)
+
+        self.assertTrue(response.from_cache)
+
+
+def _cache_entry(body):
+    return nr.CacheEntry(200, 'OK', 'http://example.com/', [('ETag', 'abc')], body)
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = nr.MemoryCache(max_entries=2)
+        cache.set('a', _cache_entry(b'a'))
+        cache.set('b', _cache_entry(b'b'))
+        cache.get('a')
+        cache.set('c', _cache_entry(b'c'))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+
+    def test_evicts_by_size(self):
+        cache = nr.MemoryCache(max_bytes=10)
+        cache.set('a', _cache_entry(b'a' * 6))
+        cache.set('b', _cache_entry(b'b' * 6))
+        cache.set('c', _cache_entry(b'c' * 11))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+
+class SQLiteCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def test_entries_are_saved(self):
+        cache = nr.SQLiteCache(self.path)
+        cache.set('a', _cache_entry(b'binarydata'))
+        cache.close()
+
+        cache = nr.SQLiteCache(self.path)
+        entry = cache.get('a')
+        cache.close()
+
+        self.assertEqual(entry.body, b'binarydata')
+        self.assertEqual(entry.headers, [('ETag', 'abc')])
+
+    def test_evicts_by_size(self):
+        cache = nr.SQLiteCache(self.path, max_entries=2, max_bytes=10)
+        cache.set('a', _cache_entry(b'a' * 6))
+        cache.set('b', _cache_entry(b'b' * 6))
+
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.get('a'))
+        cache.close()
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def test_get_returns_idle_connection(self):
+        pool = nr.ConnectionPool()
+        conn = FakeConnection()
+        pool.put('key', conn)
+
+        self.assertIs(pool.get('key'), conn)
+        self.assertIsNone(pool.get('key'))
+        conn.close()
+
+    def test_put_closes_connection_when_full(self):
+        pool = nr.ConnectionPool(maxsize=1)
+        conn1, conn2 = FakeConnection(), FakeConnection()
+        pool.put('key', conn1)
+        pool.put('key', conn2)
+
+        self.assertEqual(len(pool), 1)
+        self.assertFalse(conn1.closed)
+        self.assertTrue(conn2.closed)
+        pool.clear()
+
+    def test_idle_connections_are_evicted(self):
+        pool = nr.ConnectionPool(idle_timeout=0)
+        conn = FakeConnection()
+        pool.put('key', conn)
+
+        self.assertIsNone(pool.get('key'))
+        self.assertTrue(conn.closed)
+
+    def test_dropped_connections_are_not_returned(self):
+        pool = nr.ConnectionPool()
+        conn = FakeConnection()
+        pool.put('key', conn)
+        conn.peer.close()
+
+        self.assertIsNone(pool.get('key'))
+        self.assertTrue(conn.closed)
+
+
+class BuildOpenerTestCase(unittest.TestCase):
+    def test_opener_is_shared(self):
+        opener1 = nr._build_opener(allow_redirects=False, verify=False)
+        opener2 = nr._build_opener(allow_redirects=False, verify=False)
+
+        self.assertIs(opener1, opener2)
+
+    def test_ssl_context_is_shared(self):
+        self.assertIs(nr._ssl_context(True), nr._ssl_context(True))
+        self.assertIsNot(nr._ssl_context(True), nr._ssl_context(False))
+        self.assertFalse(nr._ssl_context(False).check_hostname)
+
+    def test_verify_with_ssl_context(self):
+        context = ssl.create_default_context()
+
+        self.assertIs(nr._ssl_context(context), context)
+        self.assertIsNot(nr._build_opener(verify=context), nr._build_opener(verify=True))
+
+
 class CodesTestCase(unittest.TestCase):
     def test_access_status_codes_as_properties(self):
         self.assertEqual(nr.codes.ok, 200)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+import asyncio
+import io
+import os
+import unittest
+
+from six.moves import urllib
+
+import notrequests as nr
+import notrequests_aio as aio
+
+
+def _url(path):
+    # See README on how to use a local httpbin instance for testing.
+    base_url = os.environ.get('NOTREQUESTS_TEST_URL', 'http://httpbin.org/')
+    return urllib.parse.urljoin(base_url, path)
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class AsyncRequestTestCase(unittest.TestCase):
+    def test_get(self):
+        url = _url('/get')
+        response = _run(aio.get(url, params={'foo': 'bar'}))
+
+        self.assertIsInstance(response, nr.Response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['args'], {'foo': 'bar'})
+
+    def test_head(self):
+        url = _url('/get')
+        response = _run(aio.head(url))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+
+    def test_post_json(self):
+        url = _url('/post')
+        response = _run(aio.post(url, json={'foo': 'bar'}))
+
+        self.assertEqual(response.json()['json'], {'foo': 'bar'})
+
+    def test_post_form_data(self):
+        url = _url('/post')
+        response = _run(aio.post(url, data={'foo': 'bar'}))
+
+        self.assertEqual(response.json()['form'], {'foo': 'bar'})
+
+    def test_submit_file(self):
+        url = _url('/post')
+        files = {'file': io.BytesIO(b'binarydata')}
+        response = _run(aio.post(url, files=files))
+
+        self.assertEqual(response.json()['files'], {'file': 'binarydata'})
+
+    def test_chunked_response(self):
+        url = _url('/stream/3')
+        response = _run(aio.get(url))
+
+        self.assertEqual(len(response.content.splitlines()), 3)
+
+    def test_follows_redirects(self):
+        url = _url('/redirect/2')
+        response = _run(aio.get(url))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_redirect_history(self):
+        url = _url('/redirect/2')
+        response = _run(aio.get(url))
+
+        self.assertEqual([r.status_code for r in response.history], [302, 302])
+
+    def test_too_many_redirects(self):
+        url = _url('/redirect/3')
+
+        with self.assertRaises(nr.TooManyRedirects):
+            _run(aio.get(url, max_redirects=2))
+
+    def test_allow_redirects_false(self):
+        url = _url('/redirect/1')
+        response = _run(aio.get(url, allow_redirects=False))
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_receiving_cookies(self):
+        url = _url('/cookies/set?foo=bar')
+        response = _run(aio.get(url, allow_redirects=False))
+
+        self.assertEqual(response.cookies, {'foo': 'bar'})
+
+    def test_timeout_raises_error(self):
+        url = _url('/delay/2')
+
+        with self.assertRaises(nr.ReadTimeout):
+            _run(aio.get(url, timeout=1))
+
+    def test_connect_and_read_timeouts(self):
+        url = _url('/delay/2')
+
+        with self.assertRaises(nr.ReadTimeout):
+            _run(aio.get(url, timeout=(5, 0.5)))
+
+    def test_deadline(self):
+        url = _url('/delay/2')
+
+        with self.assertRaises(nr.DeadlineExceeded):
+            _run(aio.get(url, timeout=5, deadline=0.5))
+
+
+class StubWriter(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        pass
+
+
+class WriteRequestTestCase(unittest.TestCase):
+    def test_file_is_written_in_chunks(self):
+        # A binary file has no lines to split it up.
+        body = b'x' * (nr._chunk_size * 3 + 1)
+        request = nr._build_request('POST', 'http://example.com/', data=io.BytesIO(body))
+        writer = StubWriter()
+        sent = _run(aio._write_request(writer, request))
+
+        head, chunks = writer.writes[0], writer.writes[1:]
+
+        self.assertEqual(b''.join(chunks), body)
+        self.assertEqual(max(len(chunk) for chunk in chunks), nr._chunk_size)
+        self.assertEqual(sent, len(head) + len(body))
+
+    def test_generator_is_written_with_chunked_encoding(self):
+        request = nr._build_request('POST', 'http://example.com/', data=iter([b'foo', b'', b'bar']))
+        writer = StubWriter()
+        _run(aio._write_request(writer, request))
+
+        self.assertIn(b'Transfer-Encoding: chunked', writer.writes[0])
+        self.assertEqual(b''.join(writer.writes[1:]), b'3\r\nfoo\r\n3\r\nbar\r\n0\r\n\r\n')
+
+
+class AsyncSessionTestCase(unittest.TestCase):
+    def test_concurrent_requests(self):
+        url = _url('/get')
+
+        async def fetch_all():
+            async with aio.AsyncSession() as session:
+                requests = [session.get(url, params={'n': n}) for n in range(10)]
+                return await asyncio.gather(*requests)
+
+        responses = _run(fetch_all())
+
+        self.assertEqual([r.json()['args']['n'] for r in responses], [str(n) for n in range(10)])
+
+    def test_session_keeps_cookies(self):
+        async def fetch():
+            async with aio.AsyncSession() as session:
+                await session.get(_url('/cookies/set?foo=bar'), allow_redirects=False)
+                return await session.get(_url('/cookies'))
+
+        response = _run(fetch())
+
+        self.assertEqual(response.json()['cookies'], {'foo': 'bar'})
+
+
+if __name__ == '__main__':
+    unittest.main()